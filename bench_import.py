@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+# ==============================================================================
+# The program measures the time needed to import the entry points of the
+# package, using python -X importtime (Python 3.7 or later), and how much
+# of it is spent loading matplotlib and scipy. Given more than one
+# directory (e.g. a checkout of an older version), it compares them.
+# ==============================================================================
+"""
+from __future__ import division, print_function
+import os
+import sys
+import argparse
+import subprocess
+
+ENTRY_POINTS = ['gof', 'process_timeseries', 'process_smc', 'process_sdc',
+                'awp2bbp', 'her2bbp', 'rwg2bbp', 'compare']
+PACKAGES = ['matplotlib', 'scipy']
+
+def import_times(dirname, module, python):
+    """
+    Imports module in a new interpreter started in dirname,
+    returns the total import time and the time spent in the
+    modules of each of PACKAGES (microseconds)
+    """
+    proc = subprocess.Popen([python, '-X', 'importtime', '-c',
+                             'import %s' % (module)],
+                            cwd=dirname, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    _, err = proc.communicate()
+    if proc.returncode != 0:
+        print("[ERROR]: cannot import %s from %s" % (module, dirname))
+        print(err)
+        sys.exit(-1)
+
+    total = 0
+    packages = dict((name, 0) for name in PACKAGES)
+    for line in err.splitlines():
+        # import time: self [us] | cumulative | imported package
+        tokens = line.split('|')
+        if not line.startswith('import time:') or len(tokens) != 3:
+            continue
+        name = tokens[2].strip()
+        try:
+            own = int(tokens[0].split(':')[1])
+            cumulative = int(tokens[1])
+        except ValueError:
+            continue
+        if name == module:
+            total = cumulative
+        root = name.split('.')[0]
+        if root in packages:
+            packages[root] += own
+    return total, [packages[name] for name in PACKAGES]
+# end of import_times
+
+def best_times(dirname, module, python, repeat):
+    """
+    Returns the fastest of repeat imports of module
+    """
+    # first import writes the .pyc files
+    import_times(dirname, module, python)
+    return min(import_times(dirname, module, python)
+               for _ in range(0, repeat))
+# end of best_times
+
+def parse_arguments():
+    """
+    Parses the command-line arguments
+    """
+    parser = argparse.ArgumentParser(description="Measures the import "
+                                     "time of the entry points.")
+    parser.add_argument("--dir", action="append", dest="dirs",
+                        help="directory with the code to measure, can be "
+                        "given more than once to compare versions "
+                        "(default: this directory)")
+    parser.add_argument("--repeat", type=int, dest="repeat", default=5,
+                        help="number of imports, the fastest one is kept")
+    parser.add_argument("--python", dest="python", default=sys.executable,
+                        help="python interpreter to use")
+    parser.add_argument('modules', nargs='*',
+                        help="modules to import (default: all entry points)")
+    args = parser.parse_args()
+
+    if args.dirs is None:
+        args.dirs = [os.path.dirname(os.path.abspath(__file__))]
+    if not args.modules:
+        args.modules = ENTRY_POINTS
+    if args.repeat < 1:
+        print("[ERROR]: Invalid number of imports!")
+        sys.exit(-1)
+    return args
+# end of parse_arguments
+
+def bench_main():
+    """
+    Prints the import time (ms) of each entry point in each directory
+    """
+    args = parse_arguments()
+
+    header = '{:>20}'.format('module')
+    for k in range(0, len(args.dirs)):
+        header += '{:>10}'.format('total%d' % (k))
+        for name in PACKAGES:
+            header += '{:>12}'.format(name[:10])
+    if len(args.dirs) > 1:
+        header += '{:>10}'.format('speedup')
+    print(' '.join(args.dirs))
+    print(header)
+
+    for module in args.modules:
+        row = '{:>20}'.format(module)
+        totals = []
+        for dirname in args.dirs:
+            total, packages = best_times(dirname, module,
+                                         args.python, args.repeat)
+            totals.append(total)
+            row += '{:>10.1f}'.format(total / 1000)
+            for value in packages:
+                row += '{:>12.1f}'.format(value / 1000)
+        if len(args.dirs) > 1:
+            row += '{:>9.2f}x'.format(totals[0] / max(totals[-1], 1))
+        print(row)
+# end of bench_main
+
+# ============================ MAIN ==============================
+if __name__ == "__main__":
+    bench_main()
+# end of main program
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+"""
+# ==============================================================================
+# The program measures the cost of sending stations to the workers of a
+# process pool: pickling the psignals with each job, or sharing their
+# arrays in a block of shared memory (gof_shm) and sending the handle.
+# Every worker returns the peaks of the three components it was given.
+# ==============================================================================
+"""
+from __future__ import division, print_function
+import sys
+import time
+import argparse
+import multiprocessing
+import numpy as np
+
+from seism import seism_psignal
+from gof_shm import check_available, shared_stations, attached_stations
+
+def make_station(samples, dt, rng):
+    """
+    Station of three psignals with random data
+    """
+    station = []
+    for _ in range(0, 3):
+        accel = rng.standard_normal(samples)
+        velo = np.cumsum(accel)*dt
+        displ = np.cumsum(velo)*dt
+        station.append(seism_psignal(samples, dt,
+                                     np.c_[displ, velo, accel], 'c',
+                                     accel, velo, displ))
+    return station
+# end of make_station
+
+def station_peaks(station):
+    """
+    Peak acceleration of each component
+    """
+    return [float(np.amax(np.absolute(signal.accel))) for signal in station]
+# end of station_peaks
+
+def peaks_none(k):
+    """
+    Job without data, measures the overhead of the pool itself
+    """
+    return [float(k)]*3
+# end of peaks_none
+
+def peaks_pickled(station):
+    """
+    Job receiving a pickled copy of the station
+    """
+    return station_peaks(station)
+# end of peaks_pickled
+
+def peaks_shared(job):
+    """
+    Job attaching to the station k of a shared block
+    """
+    handle, k = job
+    with attached_stations(handle) as stations:
+        return station_peaks(stations[k])
+# end of peaks_shared
+
+def best_time(function, repeat):
+    """
+    Returns the fastest of repeat calls of function and its result
+    """
+    best = None
+    for _ in range(0, repeat):
+        start = time.time()
+        result = function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+# end of best_time
+
+def parse_arguments():
+    """
+    Parses the command-line arguments
+    """
+    parser = argparse.ArgumentParser(description="Measures the cost of "
+                                     "sending stations to a process pool, "
+                                     "pickled or in shared memory.")
+    parser.add_argument("--stations", type=int, dest="stations", default=32,
+                        help="number of stations sent to the workers")
+    parser.add_argument("--samples", type=int, dest="samples",
+                        default=100000, help="samples of each record")
+    parser.add_argument("--workers", type=int, dest="workers", default=4,
+                        help="number of processes of the pool")
+    parser.add_argument("--repeat", type=int, dest="repeat", default=5,
+                        help="number of runs, the fastest one is kept")
+    args = parser.parse_args()
+
+    if args.stations < 1 or args.samples < 2 or args.workers < 1:
+        print("[ERROR]: Invalid number of stations, samples or workers!")
+        sys.exit(-1)
+    if args.repeat < 1:
+        print("[ERROR]: Invalid number of runs!")
+        sys.exit(-1)
+    return args
+# end of parse_arguments
+
+def bench_main():
+    """
+    Prints the time (ms) needed to score nothing but the peaks of
+    the stations in the pool with each transport
+    """
+    args = parse_arguments()
+    if not check_available():
+        sys.exit(-1)
+
+    rng = np.random.RandomState(0)
+    stations = [make_station(args.samples, 0.01, rng)
+                for _ in range(0, args.stations)]
+    expected = [station_peaks(station) for station in stations]
+    # accel, velo, displ and data of each component
+    megabytes = args.stations * 3 * 6 * args.samples * 8 / 1024 / 1024
+
+    pool = multiprocessing.Pool(args.workers)
+    try:
+        # start the workers before measuring
+        pool.map(peaks_none, range(0, args.workers))
+
+        rows = []
+        elapsed, _ = best_time(lambda: pool.map(peaks_none,
+                                                range(0, args.stations),
+                                                chunksize=1), args.repeat)
+        rows.append(('none', elapsed))
+
+        elapsed, result = best_time(lambda: pool.map(peaks_pickled, stations,
+                                                     chunksize=1),
+                                    args.repeat)
+        if result != expected:
+            print("[ERROR]: Wrong peaks from the pickled stations!")
+            sys.exit(-1)
+        rows.append(('pickle', elapsed))
+
+        def run_shared():
+            with shared_stations(stations) as handle:
+                return pool.map(peaks_shared,
+                                [(handle, k)
+                                 for k in range(0, args.stations)],
+                                chunksize=1)
+        elapsed, result = best_time(run_shared, args.repeat)
+        if result != expected:
+            print("[ERROR]: Wrong peaks from the shared stations!")
+            sys.exit(-1)
+        rows.append(('shared', elapsed))
+
+        # the stations are shared once, then sent to every job
+        with shared_stations(stations) as handle:
+            elapsed, _ = best_time(lambda: pool.map(peaks_shared,
+                                                    [(handle, k) for k in
+                                                     range(0, args.stations)],
+                                                    chunksize=1),
+                                   args.repeat)
+        rows.append(('attach', elapsed))
+    finally:
+        pool.close()
+        pool.join()
+
+    print("%d stations x 3 components x %d samples (%.1f MB), %d workers" %
+          (args.stations, args.samples, megabytes, args.workers))
+    print('{:>10}{:>12}{:>14}'.format('transport', 'total', 'per station'))
+    for name, elapsed in rows:
+        print('{:>10}{:>12.1f}{:>14.2f}'.format(name, elapsed * 1000,
+                                                elapsed * 1000 /
+                                                args.stations))
+    print("none: jobs without data; shared: copy into the block and "
+          "attach; attach: stations already shared")
+# end of bench_main
+
+# ============================ MAIN ==============================
+if __name__ == "__main__":
+    bench_main()
+# end of main program
@@ -10,10 +10,23 @@ from __future__ import division, print_function
 import os
 import sys
 import numpy as np
-import matplotlib.pyplot as plt
 from seism import s_filter, seism_signal, seism_psignal
+from file_utilities import read_file_her
 from stools import FAS, cal_acc_response, get_period, get_points, \
-    max_osc_response
+    max_osc_response, rotd
+
+# bandwidth of the Konno-Ohmachi smoothing of the Fourier spectra
+# (see set_smoothing), None uses the 3 points smooth
+fas_bandwidth = None
+
+def set_smoothing(bandwidth):
+    """
+    Sets the bandwidth of the Konno-Ohmachi smoothing of the
+    Fourier spectra plotted, None for the 3 points smooth
+    """
+    global fas_bandwidth
+    fas_bandwidth = bandwidth
+# end of set_smoothing
 
 def set_parameter(para):
     """
@@ -213,39 +226,16 @@ def read_her(filename):
     The function is to read 10-column .her files.
         Return a list of psignals for each orientation/channel.
     """
-    time, dis_ns, dis_ew, dis_up = [np.array([], float) for _ in xrange(4)]
-    vel_ns, vel_ew, vel_up = [np.array([], float) for _ in xrange(3)]
-    acc_ns, acc_ew, acc_up = [np.array([], float) for _ in xrange(3)]
-
-    try:
-        (time, dis_ns, dis_ew, dis_up,
-         vel_ns, vel_ew, vel_up,
-         acc_ns, acc_ew, acc_up) = np.loadtxt(filename, comments='#',
-                                              unpack=True)
-    except IOError:
-        print("[ERROR]: error loading her file. ")
-        return False
-
-    samples = dis_ns.size
-    dt = time[1]
-
-    # samples, dt, data, acceleration, velocity, displacement
-    psignal_ns = seism_psignal(samples, dt, np.c_[dis_ns, vel_ns, acc_ns],
-                               'c', acc_ns, vel_ns, dis_ns)
-    psignal_ew = seism_psignal(samples, dt, np.c_[dis_ew, vel_ew, acc_ew],
-                               'c', acc_ew, vel_ew, dis_ew)
-    psignal_up = seism_psignal(samples, dt, np.c_[dis_up, vel_up, acc_up],
-                               'c', acc_up, vel_up, dis_up)
-
-    station = [psignal_ns, psignal_ew, psignal_up]
-    # return samples, dt, dis_ns, dis_ew, dis_up,
-    #        vel_ns, vel_ew, vel_up, acc_ns, acc_ew, acc_up
-    return station
+    return read_file_her(filename)
+# end of read_her
 
 def plot_signals(parameter, filenames, signal1, signal2):
     """
     This function is to plot Signals with Fourier Amplitude Spectura.
     """
+    # matplotlib is only loaded when something is plotted
+    import matplotlib.pyplot as plt
+
     plt.close('all')
 
     file1 = filenames[0]
@@ -297,14 +287,18 @@ def plot_signals(parameter, filenames, signal1, signal2):
 
     if not cut_flag:
         # if user chooses not to cut; use origina/filted data for FAS and Response
-        freq1, fas1 = FAS(data1, dt1, points, xfmin, xfmax, 3)
-        freq2, fas2 = FAS(data2, dt2, points, xfmin, xfmax, 3)
+        freq1, fas1 = FAS(data1, dt1, points, xfmin, xfmax, 3,
+                          fas_bandwidth)
+        freq2, fas2 = FAS(data2, dt2, points, xfmin, xfmax, 3,
+                          fas_bandwidth)
         rsp1, rsp2 = cal_acc_response(period, [data1, data2], [dt1, dt2])
 
     else:
         # else uses cutted data for FAS and Response
-        freq1, fas1 = FAS(c_data1, dt1, points, xfmin, xfmax, 3)
-        freq2, fas2 = FAS(c_data2, dt2, points, xfmin, xfmax, 3)
+        freq1, fas1 = FAS(c_data1, dt1, points, xfmin, xfmax, 3,
+                          fas_bandwidth)
+        freq2, fas2 = FAS(c_data2, dt2, points, xfmin, xfmax, 3,
+                          fas_bandwidth)
         rsp1, rsp2 = cal_acc_response(period, [c_data1, c_data2], [dt1, dt2])
 
 
@@ -344,6 +338,8 @@ def plot_stations(parameter, filenames, station1, station2):
     This function plots two lists of psignals with Fourier Amplitude Spectra.
     station = a list of 3 psignals for three orientation.
     """
+    import matplotlib.pyplot as plt
+
     dtype = ['Displacement', 'Velocity', 'Acceleration']
     orientation = ['N/S', 'E/W', 'Up/Down']
 
@@ -402,6 +398,16 @@ def plot_stations(parameter, filenames, station1, station2):
         rsp1.append([dis_rsp1, vel_rsp1, acc_rsp1])
         rsp2.append([dis_rsp2, vel_rsp2, acc_rsp2])
 
+    # RotD50 and RotD100 of the horizontal components
+    if cut_flag:
+        rotd1 = rotd(station1[0].accel[min_i1:max_i1],
+                     station1[1].accel[min_i1:max_i1], dt1, period)
+        rotd2 = rotd(station2[0].accel[min_i2:max_i2],
+                     station2[1].accel[min_i2:max_i2], dt2, period)
+    else:
+        rotd1 = rotd(station1[0].accel, station1[1].accel, dt1, period)
+        rotd2 = rotd(station2[0].accel, station2[1].accel, dt2, period)
+
     # from displacement to velocity to acceleration
     for i in range(0, 3):
         f, axarr = plt.subplots(nrows=3, ncols=3, figsize=(12, 9))
@@ -446,13 +452,17 @@ def plot_stations(parameter, filenames, station1, station2):
 
             if not cut_flag:
                 # if user chooses not to cut; use original data to calculate FAS and Response
-                freq1, fas1 = FAS(data1, dt1, points, xfmin, xfmax, 3)
-                freq2, fas2 = FAS(data2, dt2, points, xfmin, xfmax, 3)
+                freq1, fas1 = FAS(data1, dt1, points, xfmin, xfmax, 3,
+                                  fas_bandwidth)
+                freq2, fas2 = FAS(data2, dt2, points, xfmin, xfmax, 3,
+                                  fas_bandwidth)
 
             else:
                 # use cutted signals to calculate FAS
-                freq1, fas1 = FAS(c_data1, dt1, points, xfmin, xfmax, 3)
-                freq2, fas2 = FAS(c_data2, dt2, points, xfmin, xfmax, 3)
+                freq1, fas1 = FAS(c_data1, dt1, points, xfmin, xfmax, 3,
+                                  fas_bandwidth)
+                freq2, fas2 = FAS(c_data2, dt2, points, xfmin, xfmax, 3,
+                                  fas_bandwidth)
 
             axarr[j][0] = plt.subplot2grid((3, 4), (j, 0), colspan=2, rowspan=1)
             axarr[j][0].set_title(title)
@@ -483,6 +493,16 @@ def plot_stations(parameter, filenames, station1, station2):
         f.tight_layout()
 
         plt.show()
+
+    f, axarr = plt.subplots(nrows=1, ncols=2, figsize=(12, 4))
+    for k, title in enumerate(['RotD50', 'RotD100']):
+        axarr[k].set_title(title + " Response Spectra")
+        axarr[k].set_xscale('log')
+        axarr[k].plot(period, rotd1[k], 'r', period, rotd2[k], 'b')
+        axarr[k].set_xlim(tmin, tmax)
+    axarr[0].legend([file1, file2])
+    f.tight_layout()
+    plt.show()
 # end of plot_stations
 
 def simple_plot(parameter, filenames, stations,
@@ -490,6 +510,8 @@ def simple_plot(parameter, filenames, stations,
     """
     plotting velocity for data and FAS only acceleration for Response
     """
+    import matplotlib.pyplot as plt
+
     all_styles = ['k', 'r', 'b', 'm', 'g', 'c', 'y', 'brown',
                   'gold', 'blueviolet', 'grey', 'pink']
     orientation = ['N/S', 'E/W', 'Up/Down']
@@ -566,8 +588,9 @@ def simple_plot(parameter, filenames, stations,
                                      points,
                                      xfmin,
                                      xfmax,
-                                     3) for c_vel, delta_t in zip(c_vels,
-                                                                  delta_ts)])
+                                     3,
+                                     fas_bandwidth)
+                                 for c_vel, delta_t in zip(c_vels, delta_ts)])
             rsps = cal_acc_response(period, c_accs, delta_ts)
         else:
             freqs, fas_s = zip(*[FAS(vel,
@@ -575,8 +598,9 @@ def simple_plot(parameter, filenames, stations,
                                      points,
                                      xfmin,
                                      xfmax,
-                                     3) for vel, delta_t in zip(vels,
-                                                                delta_ts)])
+                                     3,
+                                     fas_bandwidth)
+                                 for vel, delta_t in zip(vels, delta_ts)])
             rsps = cal_acc_response(period, accs, delta_ts)
 
         axarr[i][0] = plt.subplot2grid((3, 4), (i, 0), colspan=2, rowspan=1)
@@ -239,5 +239,9 @@ def compare_timeseries_main():
 
 # ============================ MAIN ==============================
 if __name__ == "__main__":
-    compare_timeseries_main()
+    try:
+        compare_timeseries_main()
+    except (IOError, ValueError) as err:
+        print("[ERROR]: %s" % (err))
+        sys.exit(-1)
 # end of main program
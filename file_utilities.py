@@ -6,12 +6,23 @@ functions used by other modules.
 # Import Python modules
 from __future__ import division, print_function, absolute_import
 import os
+import re
 import sys
+import hashlib
+import warnings
 import numpy as np
 
 # Import seismtools needed classes
 from seism import seism_psignal
 
+# directory keeping binary copies of the .her files read, see set_her_cache
+her_cache_dir = None
+
+# np.loadtxt parses text in C since numpy 1.23,
+# older versions are much faster with np.fromstring
+FAST_LOADTXT = tuple(int(re.match(r'\d*', v).group() or 0)
+                     for v in np.__version__.split('.')[:2]) >= (1, 23)
+
 def reverse_up_down(station):
     """
     reverse up down component
@@ -37,7 +48,8 @@ def scale_from_m_to_cm(station):
 
 def read_files(obs_file, input_files):
     """
-    Reads all input files
+    Reads all input files, raises IOError or ValueError
+    if any of them cannot be read
     """
     # read obs data
     obs_data = None
@@ -45,8 +57,7 @@ def read_files(obs_file, input_files):
         obs_data = read_file(obs_file)
         # Make sure we got it
         if not obs_data:
-            print("[ERROR]: Reading obs file: %s!" % (obs_file))
-            sys.exit(-1)
+            raise IOError("Reading obs file: %s!" % (obs_file))
         # Fix units if needed
         if obs_file.lower().endswith(".bbp"):
             units = read_unit_bbp(obs_file)
@@ -65,8 +76,7 @@ def read_files(obs_file, input_files):
         station = read_file(input_file)
         # Make sure we got it
         if not station:
-            print("[ERROR]: Reading input file: %s!" % (input_file))
-            sys.exit(-1)
+            raise IOError("Reading input file: %s!" % (input_file))
         # Fix units if needed
         if input_file.lower().endswith(".bbp"):
             units = read_unit_bbp(input_file)
@@ -124,6 +134,46 @@ def read_filelist(filelist):
     return station_list, coor_x, coor_y
 # end of read_filelist
 
+def index_station_files(dirname):
+    """
+    Lists dirname once and indexes its timeseries files by station name.
+    A file is indexed under every leading part of its name that is
+    followed by one of '-', ',', '_', '.' (with '.' replaced by '_' as
+    in read_filelist), so STA.obs.vel.bbp is found for station STA.
+    Returns a dictionary mapping station names to a dictionary
+    of 'dis', 'vel', 'acc', and 'her' files.
+    """
+    index = {}
+    try:
+        filenames = sorted(os.listdir(dirname))
+    except OSError as err:
+        print(err)
+        return index
+
+    extensions = [('.dis.bbp', 'dis'), ('.vel.bbp', 'vel'),
+                  ('.acc.bbp', 'acc'), ('.her', 'her')]
+    for filename in filenames:
+        if filename.startswith('.'):
+            continue
+        for extension, ftype in extensions:
+            if filename.endswith(extension):
+                break
+        else:
+            continue
+
+        stem = filename[:-len(extension)]
+        names = set()
+        for i in range(1, len(stem)):
+            if stem[i] in '-,_.':
+                names.add(stem[:i].replace('.', '_'))
+        for name in names:
+            files = index.setdefault(name, {'dis': [], 'vel': [],
+                                            'acc': [], 'her': []})
+            files[ftype].append(os.path.join(dirname, filename))
+
+    return index
+# end of index_station_files
+
 # ================================ READING ================================
 def read_file(filename):
     """
@@ -167,8 +217,7 @@ def read_file_bbp2(filename):
             ew_comp = np.append(ew_comp, pieces[2])
             ud_comp = np.append(ud_comp, pieces[3])
     except IOError:
-        print("[ERROR]: error reading bbp file: %s" % (filename))
-        sys.exit(1)
+        raise IOError("error reading bbp file: %s" % (filename))
 
     # All done!
     return time, ns_comp, ew_comp, ud_comp
@@ -184,8 +233,7 @@ def read_file_bbp(filename):
 
     base_tokens = base_file.split('.')[0:-2]
     if not base_tokens:
-        print("[ERROR]: Invalid BBP filename: %s" % (filename))
-        sys.exit(1)
+        raise ValueError("Invalid BBP filename: %s" % (filename))
     dis_tokens = list(base_tokens)
     vel_tokens = list(base_tokens)
     acc_tokens = list(base_tokens)
@@ -222,43 +270,146 @@ def read_file_bbp(filename):
     return station
 # end of read_file_bbp
 
-def read_file_her(filename):
+def set_her_cache(dirname):
     """
-    The function is to read 10-column .her files.
-    Return a list of psignals for each orientation.
+    Keeps binary copies of the .her files read in dirname, so reading
+    them again skips the text parsing. None disables the cache
     """
-    time, dis_ns, dis_ew, dis_up = [np.array([], float) for _ in xrange(4)]
-    vel_ns, vel_ew, vel_up = [np.array([], float) for _ in xrange(3)]
-    acc_ns, acc_ew, acc_up = [np.array([], float) for _ in xrange(3)]
+    global her_cache_dir
+    her_cache_dir = dirname
+# end of set_her_cache
+
+def her_cache_path(filename):
+    """
+    Path of the binary copy of a .her file, it changes
+    whenever the file is modified
+    """
+    stat = os.stat(filename)
+    key = "%s:%d:%r" % (os.path.abspath(filename), stat.st_size,
+                        stat.st_mtime)
+    key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(her_cache_dir, "%s.npy" % (key))
+# end of her_cache_path
+
+def parse_her(filename):
+    """
+    Parses the numbers of a .her file, (samples x 10) array.
+    Raises ValueError if the file is not made of 10 columns
+    """
+    if FAST_LOADTXT:
+        return check_her_columns(filename,
+                                 np.loadtxt(filename, comments='#', ndmin=2))
+
+    with open(filename, 'r') as her_file:
+        text = her_file.read()
+
+    # skip the header lines, then parse all numbers at once; files
+    # with other comments, blank lines or rows that are not made of
+    # 10 numbers go to np.loadtxt
+    start = 0
+    while True:
+        end = text.find('\n', start)
+        if end < 0 or ('#' not in text[start:end] and
+                       text[start:end].strip()):
+            break
+        start = end + 1
+    body = text[start:].rstrip()
+    rows = body.count('\n') + 1
+    end = body.find('\n')
+    if end < 0:
+        end = len(body)
+    data = None
+    if '#' not in body and len(body[:end].split()) == 10:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', DeprecationWarning)
+            try:
+                data = np.fromstring(body, dtype=float, sep=' ')
+            except (DeprecationWarning, ValueError):
+                data = None
+    if data is None or data.size != rows * 10:
+        return check_her_columns(filename,
+                                 np.loadtxt(filename, comments='#', ndmin=2))
+    return data.reshape(-1, 10)
+# end of parse_her
+
+def check_her_columns(filename, data):
+    """
+    Returns the numbers parsed from a .her file if they make
+    10 columns, raises ValueError otherwise
+    """
+    if data.shape[1] != 10:
+        raise ValueError("%s has %d columns instead of 10!" %
+                         (filename, data.shape[1]))
+    return data
+# end of check_her_columns
+
+def load_her(filename):
+    """
+    Reads the samples of a 10-column .her file into a single
+    (samples x 10) array. Returns None if the file cannot be read
+    """
+    cache = None
+    if her_cache_dir is not None:
+        try:
+            cache = her_cache_path(filename)
+            if os.path.exists(cache):
+                return np.load(cache)
+        except (IOError, OSError, ValueError):
+            pass
 
     try:
-        (time, dis_ns, dis_ew, dis_up, vel_ns, vel_ew,
-         vel_up, acc_ns, acc_ew, acc_up) = np.loadtxt(filename,
-                                                      comments='#',
-                                                      unpack=True)
+        data = parse_her(filename)
     except IOError:
-        print("[ERROR]: error loading her file.")
-        return False
+        return None
+    except ValueError as err:
+        print("[ERROR]: %s" % (err))
+        return None
 
-    samples = dis_ns.size
-    delta_t = time[1]
+    if cache is not None:
+        try:
+            if not os.path.exists(her_cache_dir):
+                os.makedirs(her_cache_dir)
+            tmp_path = "%s.%d.tmp" % (cache, os.getpid())
+            with open(tmp_path, 'wb') as out_file:
+                np.save(out_file, data)
+            os.rename(tmp_path, cache)
+        except (IOError, OSError) as err:
+            print(err)
+
+    return data
+# end of load_her
 
-    # samples, dt, data, acceleration, velocity, displacement
-    psignal_ns = seism_psignal(samples, delta_t, np.c_[dis_ns, vel_ns, acc_ns],
-                               'c', acc_ns, vel_ns, dis_ns)
-    psignal_ew = seism_psignal(samples, delta_t, np.c_[dis_ew, vel_ew, acc_ew],
-                               'c', acc_ew, vel_ew, dis_ew)
-    psignal_up = seism_psignal(samples, delta_t, np.c_[dis_up, vel_up, acc_up],
-                               'c', acc_up, vel_up, dis_up)
+def read_file_her(filename):
+    """
+    The function is to read 10-column .her files.
+    Return a list of psignals for each orientation.
+    The psignals share the array of the file.
+    """
+    data = load_her(filename)
+    if data is None:
+        print("[ERROR]: error loading her file.")
+        return False
 
-    station = [psignal_ns, psignal_ew, psignal_up]
+    # time, dis_ns, dis_ew, dis_up, vel_ns, vel_ew, vel_up,
+    # acc_ns, acc_ew, acc_up
+    samples = data.shape[0]
+    delta_t = data[1, 0]
+
+    station = []
+    for i in range(0, 3):
+        # samples, dt, data, acceleration, velocity, displacement
+        # data columns are displ, velo, accel
+        station.append(seism_psignal(samples, delta_t, data[:, (1+i)::3],
+                                     'c', data[:, 7+i], data[:, 4+i],
+                                     data[:, 1+i]))
     return station
 # end of read_file_her
 
 def read_unit_bbp(filename):
     """
     Get the units from the file's header
-    Returns either "m" or "cm"
+    Returns either "m" or "cm", raises IOError or ValueError
+    if they cannot be read
     """
     units = None
 
@@ -270,13 +421,11 @@ def read_unit_bbp(filename):
                 break
         input_file.close()
     except IOError:
-        print("[ERROR]: No such file.")
-        sys.exit(-1)
+        raise IOError("No such file: %s" % (filename))
 
     # Make sure we got something
     if units is None:
-        print("[ERROR]: Cannot find units in bbp file!")
-        sys.exit(-1)
+        raise ValueError("Cannot find units in bbp file: %s!" % (filename))
 
     # Figure out if we have meters or centimeters
     if units == "cm" or units == "cm/s" or units == "cm/s^2":
@@ -285,8 +434,7 @@ def read_unit_bbp(filename):
         return "m"
 
     # Invalid units in this file
-    print("[ERROR]: Cannot parse units in bbp file!")
-    sys.exit(-1)
+    raise ValueError("Cannot parse units in bbp file: %s!" % (filename))
 # end of read_unit_bbp
 
 def read_stamp(filename):
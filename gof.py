@@ -10,18 +10,40 @@ from __future__ import division, print_function
 
 import os
 import sys
-import glob
 import math
 import argparse
 import numpy as np
 
-from process_timeseries import process
-from file_utilities import read_filelist, read_files
-from ptools import get_bands
+from process_timeseries import process, process_obs, process_synthetics, \
+    check_params, missing_options, exit_on_errors, BATCH_OPTIONS
+from file_utilities import read_filelist, read_files, index_station_files, \
+    set_her_cache
+from ptools import get_bands, parse_bands
 from gof_engine import print_scores, set_labels, set_mlabels, \
-    scores_matrix, print_matrix, parameter_to_list
+    scores_matrices, print_matrix, parameter_to_list, select_metrics, \
+    print_spectra, set_period_grid, band_periods, set_fas_smoothing, \
+    set_score_threads, set_progress, METRICS
+from stools import get_period, period_grid
 from gof_data_sim import get_dt, get_azimuth, get_leading, get_earthq, \
-    get_fmax
+    parse_earthq, get_fmax
+from gof_cache import cache_key, load_scores, save_scores, KEY_PARAMETERS
+from gof_store import create_store, store_station, save_store, load_store, \
+    merge_store
+from gof_prefetch import prefetch
+
+# parameters written in the checkpoint manifest, a run is only
+# resumed (or its shards merged) if they are the same
+CHECKPOINT_PARAMETERS = KEY_PARAMETERS + ['spectra_damping']
+
+# number of stations between saves of the score store
+STORE_INTERVAL = 20
+
+# parameters not needed to process the signals, as used by gof_pair
+LIBRARY_DEFAULTS = {'azimuth': None, 'metrics': None, 'cache_dir': None,
+                    'cache_size': 1024.0 * 1024 * 1024, 'her_cache': None,
+                    'spectra_damping': None, 'periods': None,
+                    'ko_bandwidth': None, 'threads': 1,
+                    'outdir': None, 'progress': False}
 
 np.seterr(divide='ignore', invalid='ignore')
 
@@ -99,48 +121,520 @@ def get_out():
     path2 = os.path.join(outdir, outname2)
     return outdir, path1, path2
 
-def search_file(dirname, info):
-    """
-    Search for files contains given station code and name
-    """
-    info = info.replace('.', '')
-    for fp in os.listdir(dirname):
-        tmp = fp.replace('.', '')
-        if (info in tmp) and ('HN' in tmp):
-            return fp
-            # file_dir['HN'] = fp
-        elif (info in tmp) and ('V1' in tmp):
-            # file_dir['V1'] = fp
-            return fp
-        elif (info in tmp) and ('BH' in tmp):
-            # file_dir['BH'] = fp
-            return fp
-        elif (info in tmp) and ('V2' in tmp):
-            # file_dir['V2'] = fp
-            return fp
-        # endif case
-    # end for
-
-    # was not found, return same info
-    return info
-# end of search_file
-
-def find_station(input_directory, station_name):
-    """
-    Looks into input_directory for data belonging to a station whose name
-    matches station_name
-    """
-    filelist = glob.glob("%s/%s[-,_,.]*.vel.bbp" % (input_directory, station_name))
-    # Check if we found anything
-    if not filelist:
+def find_station(index, station_name):
+    """
+    Looks into the index of an input directory (see index_station_files)
+    for data belonging to a station whose name matches station_name.
+    Returns a list with the candidate files: velocity bbp files,
+    or Hercules files if there are no bbp files
+    """
+    if station_name not in index:
+        return []
+    files = index[station_name]
+    if files['vel']:
+        return files['vel']
+    return files['her']
+# end of find_station
+
+def report_ambiguous(station_list, indexes):
+    """
+    Prints the stations with more than one file to choose
+    from in any of the indexed input directories
+    """
+    found = False
+    for station_name in station_list:
+        for dirname, index in indexes:
+            filelist = find_station(index, station_name)
+            if len(filelist) > 1:
+                if not found:
+                    print("[ERROR]: Multiple files to choose from, "
+                          "these stations will not be processed:")
+                    found = True
+                print("%s (%s): %s" % (station_name, dirname,
+                                       ", ".join(filelist)))
+    return found
+# end of report_ambiguous
+
+def plan_station(station_name, index1, runs):
+    """
+    Decides what to do with a station in each run, before its files
+    are read. Returns a list of (action, run, files, notes), action
+    being 'skip' (already processed), 'ignore' (files missing or
+    ambiguous) or 'pair'; notes go to the list of unprocessed stations
+    """
+    actions = []
+    files1 = find_station(index1, station_name)
+    for run in runs:
+        # skip stations finished in a previous run
+        if station_name in run['done']:
+            notes = []
+            if run['done'][station_name][2] == 'div0':
+                notes.append("%s (div by zero)" % (station_name))
+            actions.append(('skip', run, None, notes))
+            continue
+
+        # capture full path to files
+        files2 = find_station(run['index'], station_name)
+        if len(files1) != 1 or len(files2) != 1:
+            # Add to list of unprocessed stations
+            notes = []
+            if not files1:
+                notes.append("%s (no data)" % (station_name))
+            elif len(files1) > 1:
+                notes.append("%s (ambiguous data)" % (station_name))
+            if not files2:
+                notes.append("%s (no synthetic)" % (station_name))
+            elif len(files2) > 1:
+                notes.append("%s (ambiguous synthetic)" % (station_name))
+            actions.append(('ignore', run, None, notes))
+            continue
+
+        actions.append(('pair', run, [files1[0], files2[0]], []))
+    return actions
+# end of plan_station
+
+def parse_shard(text):
+    """
+    Reads a shard given as i/N, returns (i, N) or None
+    if the format is not valid or i is not in 0...N-1
+    """
+    tokens = text.split('/')
+    if len(tokens) != 2:
+        return None
+    try:
+        shard = int(tokens[0])
+        count = int(tokens[1])
+    except ValueError:
+        return None
+    if count < 1 or not 0 <= shard < count:
+        return None
+    return shard, count
+# end of parse_shard
+
+def station_size(station_name, indexes):
+    """
+    Total size (bytes) of the files of a station
+    in the indexes of the input directories
+    """
+    size = 0
+    for index in indexes:
+        if station_name not in index:
+            continue
+        for filelist in index[station_name].values():
+            size += sum(os.path.getsize(fp) for fp in filelist)
+    return size
+# end of station_size
+
+def shard_stations(sizes, shard, count):
+    """
+    Splits the stations in count shards of similar total size: from
+    the largest station to the smallest, each one goes to the shard
+    with the smallest total so far (then the fewest stations, then
+    the first one). Returns the indexes of the stations of the
+    given shard, in the order of the list
+    """
+    totals = [(0, 0, k) for k in range(0, count)]
+    selected = []
+    for i in sorted(range(0, len(sizes)), key=lambda i: (-sizes[i], i)):
+        total, stations, k = min(totals)
+        totals[k] = (total + sizes[i], stations + 1, k)
+        if k == shard:
+            selected.append(i)
+    return sorted(selected)
+# end of shard_stations
+
+def read_station(job):
+    """
+    Reads the files of the pairs planned for a station: the recorded
+    data (once) and the simulation of each pair
+    """
+    _, actions = job
+    files = [item[2] for item in actions if item[0] == 'pair']
+    if not files:
+        return None, []
+    obs_data, _ = read_files(files[0][0], [])
+    _, stations = read_files(None, [item[1] for item in files])
+    return obs_data, stations
+# end of read_station
+
+def read_checkpoint(checkpoint):
+    """
+    Reads the checkpoint manifest of a previous run, returns a
+    dictionary with the [file1, file2, status] of each finished station
+    """
+    done = {}
+    if not os.path.exists(checkpoint):
+        return done
+
+    with open(checkpoint, 'r') as cp_file:
+        for line in cp_file:
+            # the parameters of the run (see checkpoint_params)
+            if line.startswith('#'):
+                continue
+            tokens = line.split()
+            # skip entries that were not completely written
+            if not line.endswith('\n') or len(tokens) != 4:
+                continue
+            if tokens[3] not in ['scored', 'div0']:
+                continue
+            done[tokens[0]] = tokens[1:]
+    return done
+# end of read_checkpoint
+
+def checkpoint_params(params):
+    """
+    Line of the checkpoint manifest with the parameters used
+    to process the signals and get their scores
+    """
+    return "# %s\n" % (";".join(["%s=%r" % (name, params.get(name))
+                                 for name in CHECKPOINT_PARAMETERS]))
+# end of checkpoint_params
+
+def read_checkpoint_params(checkpoint):
+    """
+    Returns the line with the parameters of the run written
+    in a checkpoint manifest, None if there is not one
+    """
+    if not os.path.exists(checkpoint):
+        return None
+    with open(checkpoint, 'r') as cp_file:
+        line = cp_file.readline()
+    if not line.startswith('#'):
         return None
-    # Only one option
-    if len(filelist) == 1:
-        return filelist[0]
-    # Multiple options, need to figure out which one we want
-    print("Multiple files to choose from!")
-    print(filelist)
-    sys.exit(0)
+    return line
+# end of read_checkpoint_params
+
+def print_checkpoint(checkpoint, station, filenames, status):
+    """
+    Appends a finished station to the checkpoint manifest
+    """
+    file1 = filenames[0].split('/')[-1]
+    file2 = filenames[1].split('/')[-1]
+    with open(checkpoint, 'a') as cp_file:
+        cp_file.write("%s %s %s %s\n" % (station, file1, file2, status))
+        cp_file.flush()
+        os.fsync(cp_file.fileno())
+# end of print_checkpoint
+
+def resume_scores(path, header, pairs):
+    """
+    Keeps only the rows of a previous run whose pair of files is in
+    pairs, and returns the pairs of files found in the file
+    """
+    found = set()
+    rows = []
+    with open(path, 'r') as in_file:
+        lines = in_file.readlines()
+
+    if not lines or lines[0] != header:
+        print("[ERROR]: Cannot resume, %s was generated with different "
+              "bands or metrics!" % (path))
+        sys.exit(-1)
+
+    for line in lines[1:]:
+        tokens = line.split()
+        # skip rows that were not completely written
+        if not line.endswith('\n') or len(tokens) < 2:
+            continue
+        pair = (tokens[0], tokens[1])
+        if pair not in pairs or pair in found:
+            continue
+        found.add(pair)
+        rows.append(line)
+
+    # replace the file atomically
+    tmp_path = "%s.tmp" % (path)
+    with open(tmp_path, 'w') as out_file:
+        out_file.write(header)
+        out_file.writelines(rows)
+    os.rename(tmp_path, path)
+
+    return found
+# end of resume_scores
+
+def prepare_outputs(params, indir2, outdir, s_header, m_header,
+                    station_list):
+    """
+    Prepares the output files for comparing the recorded data against
+    the simulations in indir2. Returns a dictionary with their paths,
+    the stations finished in a previous run (if resuming), the list
+    for stations that fail to be processed, and the score store
+    """
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    run = {}
+    run['indir2'] = indir2
+    run['index'] = index_station_files(indir2)
+    run['outdir'] = outdir
+    run['s_path'] = os.path.join(outdir, os.path.basename(params['s_path']))
+    run['m_path'] = os.path.join(outdir, os.path.basename(params['m_path']))
+    run['unprocessed'] = []
+
+    # manifest with the stations already finished
+    run['checkpoint'] = os.path.join(outdir, "checkpoint.txt")
+    run['done'] = {}
+
+    # arrays with the results of all stations
+    run['store'] = None
+    if params['store'] is not None:
+        run['store_path'] = os.path.join(outdir,
+                                         os.path.basename(params['store']))
+        run['store'] = create_store(station_list, params['bands'],
+                                    params['metrics'])
+        run['unsaved'] = 0
+
+    if (params['resume'] and os.path.exists(run['s_path']) and
+            os.path.exists(run['m_path'])):
+        # results of a previous run with other processing are not kept
+        if read_checkpoint_params(run['checkpoint']) != \
+                checkpoint_params(params):
+            print("[ERROR]: Cannot resume, %s was generated with different "
+                  "processing parameters!" % (outdir))
+            sys.exit(-1)
+
+        # keep results of the stations finished in the previous run
+        done = read_checkpoint(run['checkpoint'])
+        if run['store'] is not None:
+            # stations missing in the store are computed again
+            stored = merge_store(run['store'], load_store(run['store_path']))
+            for station in list(done):
+                if station not in stored:
+                    del done[station]
+        pairs = set([(item[0], item[1]) for item in done.values()
+                     if item[2] == 'scored'])
+        pairs = (resume_scores(run['s_path'], s_header, pairs) &
+                 resume_scores(run['m_path'], m_header, pairs))
+        for station in list(done):
+            item = done[station]
+            if item[2] == 'scored' and (item[0], item[1]) not in pairs:
+                del done[station]
+        run['done'] = done
+    else:
+        # open output files
+        try:
+            f = open(run['s_path'], 'w')
+            m = open(run['m_path'], 'w')
+            with open(run['checkpoint'], 'w') as cp_file:
+                cp_file.write(checkpoint_params(params))
+        except IOError as err:
+            print(err)
+
+        f.write(s_header)
+        m.write(m_header)
+        f.close()
+        m.close()
+
+    return run
+# end of prepare_outputs
+
+def update_store(run):
+    """
+    Saves the score store of a run every STORE_INTERVAL stations
+    """
+    run['unsaved'] += 1
+    if run['unsaved'] >= STORE_INTERVAL:
+        save_store(run['store_path'], run['store'])
+        run['unsaved'] = 0
+# end of update_store
+
+def compute_scores(station1, station2, params, raw=None):
+    """
+    Calculates the scores matrix for a pair of stations,
+    using the cache of previous results if one is given.
+    If given, raw is filled with the scores before rounding.
+    """
+    return compute_batch([(station1, station2)], params, [raw])[0]
+# end of compute_scores
+
+def compute_batch(pairs, params, raws):
+    """
+    Calculates the scores matrices of many pairs of stations, the
+    ones not found in the cache (if given) are scored together.
+    Each raw given is filled with the scores before rounding.
+    """
+    results = [None]*len(pairs)
+    keys = [None]*len(pairs)
+    missing = []
+    for k, (station1, station2) in enumerate(pairs):
+        if params['cache_dir'] is None:
+            missing.append(k)
+            continue
+        keys[k] = cache_key(station1, station2, params)
+        cached = load_scores(params['cache_dir'], keys[k])
+        if cached is None:
+            missing.append(k)
+            continue
+        if params['progress']:
+            print("...Using cached scores")
+        parameter, matrix, flag, cached_raw = cached
+        if raws[k] is not None:
+            raws[k][...] = cached_raw
+        results[k] = parameter, matrix, flag
+
+    raws = list(raws)
+    if params['cache_dir'] is not None:
+        for k in missing:
+            if raws[k] is None:
+                raws[k] = np.empty((4, len(params['bands'])+2,
+                                    len(params['metrics'])+2))
+    scored = scores_matrices([pairs[k] for k in missing], params['bands'],
+                             params['metrics'], [raws[k] for k in missing])
+    for k, result in zip(missing, scored):
+        results[k] = result
+        if params['cache_dir'] is not None:
+            parameter, matrix, flag = result
+            save_scores(params['cache_dir'], keys[k], parameter, matrix,
+                        flag, raws[k], params['cache_size'])
+    return results
+# end of compute_scores
+
+def score_pending(pending, station_list, params):
+    """
+    Scores together the pairs of stations waiting in pending, a list
+    of (run, notes, task), and writes the results of each one to the
+    outputs of its run, in the order of pending
+    """
+    tasks = [task for _, _, task in pending if task]
+    results = iter(compute_batch([task['pair'] for task in tasks], params,
+                                 [task['raw'] for task in tasks]))
+
+    for run, notes, task in pending:
+        run['unprocessed'].extend(notes)
+        if not task:
+            continue
+        parameter, matrix, flag = next(results)
+        i = task['index']
+        files = task['files']
+        coord = task['coord']
+        raw = task['raw']
+
+        # Sanity check to avoid division by zero
+        if not flag:
+            tmpmsg = "%s (div by zero)" % (station_list[i])
+            run['unprocessed'].append(tmpmsg)
+            print("...Ignoring station:   %s (div by zero)" %
+                  (station_list[i]))
+            if run['store'] is not None:
+                raw.fill(np.nan)
+                store_station(run['store'], i, files, coord, 'div0')
+                update_store(run)
+            print_checkpoint(run['checkpoint'], station_list[i],
+                             files, 'div0')
+            continue
+        # end if: sanity check
+
+        if run['store'] is not None:
+            store_station(run['store'], i, files, coord, 'scored',
+                          parameter=parameter)
+            update_store(run)
+
+        parameter = parameter_to_list(parameter, params['metrics'])
+
+        # print scores
+        print_scores(files, coord, run['s_path'], [], matrix)
+        # print values used to calculate scores
+        print_scores(files, coord, run['m_path'], parameter, np.array([]))
+        # both rows are written, station is finished
+        print_checkpoint(run['checkpoint'], station_list[i], files, 'scored')
+# end of score_pending
+
+def score_files(obs_file, syn_files, params, raw=None):
+    """
+    Reads, processes and scores a pair of files: the recorded data
+    and a simulation, or two simulations if obs_file is None
+    """
+    obs_data, stations = read_files(obs_file, syn_files)
+    # processing signals
+    obs_data, stations = process(obs_file, obs_data, stations, params)
+
+    # Figure out stations 1 & 2
+    if obs_data is None:
+        station1 = stations[0]
+        station2 = stations[1]
+    else:
+        station1 = obs_data
+        station2 = stations[0]
+
+    # the spectra are only written next to the scores
+    if params['spectra_damping'] and params['outdir'] is not None:
+        write_spectra(params['outdir'], syn_files[-1],
+                      station1, station2, params)
+
+    # Calculate scores matrix
+    return compute_scores(station1, station2, params, raw)
+# end of score_files
+
+def write_spectra(outdir, filename, station1, station2, params):
+    """
+    Writes the response spectra of a pair of stations for every
+    damping requested, next to the scores, periods spanning the bands
+    """
+    tmin = 1/params['bands'][-1]
+    tmax = 1/params['bands'][0]
+    if params['periods'] is None:
+        period = get_period(tmin, tmax)
+    else:
+        period = period_grid(tmin, tmax, params['periods'])
+    path = os.path.join(outdir, "%s.rsp" % (os.path.basename(filename)))
+    print_spectra(path, station1, station2, period,
+                  params['spectra_damping'])
+# end of write_spectra
+
+def check_inputs(params):
+    """
+    Checks that the input files and directories exist,
+    returns a list with the error messages
+    """
+    errors = []
+    filenames = [params.get('obs_file'), params.get('filelist')]
+    filenames.extend(params.get('syn_files') or [])
+    for filename in filenames:
+        if filename is not None and not os.path.isfile(filename):
+            errors.append("No such file: %s" % (filename))
+    for dirname in params.get('indirs') or []:
+        if not os.path.isdir(dirname):
+            errors.append("No such directory: %s" % (dirname))
+    return errors
+# end of check_inputs
+
+def gof_pair(obs_file, syn_files, params):
+    """
+    Scores a pair of files without asking or writing anything, so
+    it can be called from other programs. params has the entries
+    set by parse_arguments (bands, decifmax, commondt, eq_time and
+    leading are required); the response spectra (spectra_damping)
+    are only written if an outdir is given, and the progress only
+    if progress is set. Returns parameter, matrix, the scores
+    before rounding and the flag returned by scores_matrix.
+    Raises ValueError if the parameters are not valid, IOError or
+    ValueError if the files cannot be read or processed.
+    """
+    params = dict(LIBRARY_DEFAULTS, **params)
+    params['obs_file'] = obs_file
+    params['syn_files'] = list(syn_files or [])
+
+    errors = check_params(params) + check_inputs(params)
+    if len(params['syn_files']) + (obs_file is not None) != 2:
+        errors.append("Please specify 2 input files!")
+    for metric in params['metrics'] or []:
+        if metric not in METRICS:
+            errors.append("Invalid metric: %s" % (metric))
+    if errors:
+        raise ValueError(" ".join(errors))
+    params['metrics'] = select_metrics(params['metrics'])
+
+    set_her_cache(params['her_cache'])
+    set_period_grid(params['periods'])
+    set_fas_smoothing(params['ko_bandwidth'])
+    set_score_threads(params['threads'])
+    set_progress(params['progress'])
+
+    raw = np.empty((4, len(params['bands'])+2, len(params['metrics'])+2))
+    parameter, matrix, flag = score_files(obs_file, params['syn_files'],
+                                          params, raw)
+    return parameter, matrix, raw, flag
+# end of gof_pair
 
 def parse_arguments():
     """
@@ -175,15 +669,69 @@ def parse_arguments():
     parser.add_argument("--list", dest="filelist",
                         help="list containing files to use")
     parser.add_argument("--input_dir", action="append", dest="indirs",
-                        help="input directories for the files in the list")
+                        help="input directories for the files in the list, "
+                        "the first one with recorded data, then one or "
+                        "more with simulations")
     parser.add_argument("--epicenter_x", type=float, dest="epicenter_x",
                         help="epicenter coordinates")
     parser.add_argument("--epicenter_y", type=float, dest="epicenter_y",
                         help="epicenter coordinates")
+    parser.add_argument("--resume", action="store_true", dest="resume",
+                        help="continue a previous run with a list of files, "
+                        "only computing stations not yet processed")
+    parser.add_argument("--cache-dir", dest="cache_dir",
+                        help="directory used to cache scores of "
+                        "pairs of stations")
+    parser.add_argument("--cache-size", type=float, dest="cache_size",
+                        default=1024.0,
+                        help="maximum size of the cache (MB)")
+    parser.add_argument("--store", dest="store",
+                        help="npz file to also store the unrounded results "
+                        "of all stations (list of files only)")
+    parser.add_argument("--her-cache", dest="her_cache",
+                        help="directory to keep binary copies of the "
+                        ".her files read, so they are parsed only once")
+    parser.add_argument("--prefetch", type=int, dest="prefetch", default=2,
+                        help="number of stations read ahead while scoring "
+                        "a list of files, 0 reads them when needed")
+    parser.add_argument("--stack", type=int, dest="stack", default=8,
+                        help="number of stations scored together while "
+                        "scoring a list of files, the ones with the same "
+                        "dt and number of samples share array operations")
+    parser.add_argument("--threads", type=int, dest="threads", default=1,
+                        help="number of threads computing the components "
+                        "and bands of a pair of stations, for a faster "
+                        "comparison of two files")
+    parser.add_argument("--shard", dest="shard",
+                        help="i/N, scores only the i-th (0...N-1) of N "
+                        "shards of the list of files, of similar total "
+                        "file size; each shard needs its own output "
+                        "directory, gof_merge.py combines them")
+    parser.add_argument("--metric-subset", dest="metric_subset",
+                        help="sequence of metrics to compute (C1...C13), "
+                        "C1...C11 are computed by default, C12 and C13 "
+                        "compare the RotD50 and RotD100 spectra")
+    parser.add_argument("--spectra-damping", dest="spectra_damping",
+                        help="sequence of damping ratios (e.g. 0.02,0.05), "
+                        "the response spectra of each pair for all of "
+                        "them are written next to the scores")
+    parser.add_argument("--periods", dest="periods",
+                        help="periods of the response spectra: a number of "
+                        "log-spaced periods over all the bands, or nga; each "
+                        "band uses the ones in its range (default: 20 "
+                        "periods in each band)")
+    parser.add_argument("--ko-bandwidth", type=float, dest="ko_bandwidth",
+                        help="bandwidth of the Konno-Ohmachi smoothing of "
+                        "the Fourier spectra (e.g. 40), by default they "
+                        "are smoothed over 3 points")
+    parser.add_argument("--batch", action="store_true", dest="batch",
+                        help="never ask for missing parameters, "
+                        "fail if any of them is not given")
     args = parser.parse_args()
 
     # Parameters from the user
     params = {}
+    params['batch'] = args.batch
 
     # Figure out if we have a pair or timeseries or a list of files to use
     if args.filelist is not None and (args.obs_file is not None or
@@ -196,12 +744,21 @@ def parse_arguments():
         params["filelist"] = args.filelist
         if args.indirs is None:
             params["indir1"], params["indir2"] = get_in()
+            params["indir2s"] = [params["indir2"]]
         else:
-            if len(args.indirs) == 2:
+            if len(args.indirs) >= 2:
                 params["indir1"] = args.indirs[0]
                 params["indir2"] = args.indirs[1]
+                params["indir2s"] = args.indirs[1:]
             else:
-                print("[ERROR]: Please specify 2 input directories!")
+                print("[ERROR]: Please specify at least 2 input directories!")
+                sys.exit(-1)
+            # each simulation writes its outputs to its own directory
+            names = [os.path.basename(os.path.normpath(indir))
+                     for indir in params["indir2s"]]
+            if len(names) > 1 and len(set(names)) != len(names):
+                print("[ERROR]: Simulation directories must have "
+                      "different names!")
                 sys.exit(-1)
     else:
         # A pair of files
@@ -221,28 +778,37 @@ def parse_arguments():
         params["obs_file"] = args.obs_file
         params["syn_files"] = args.syn_files
 
+    # In batch mode everything comes from the command line
+    if args.batch:
+        options = BATCH_OPTIONS + [('s_path', '--scores'),
+                                   ('m_path', '--metrics')]
+        if args.filelist is not None:
+            options.append(('indirs', '--input_dir'))
+        errors = missing_options(args, options)
+        errors.extend(check_inputs({'obs_file': args.obs_file,
+                                    'syn_files': args.syn_files,
+                                    'filelist': args.filelist,
+                                    'indirs': args.indirs}))
+        exit_on_errors(errors)
+
     # Ask user for any missing input parameters
     if args.outdir is None or args.s_path is None or args.m_path is None:
         params['outdir'], params['s_path'], params['m_path'] = get_out()
     else:
         params['outdir'] = args.outdir
+        # check existence of target directory before any work starts
+        try:
+            if not os.path.exists(args.outdir):
+                os.makedirs(args.outdir)
+        except OSError as err:
+            print("[ERROR]: %s" % (err))
+            sys.exit(-1)
         params['s_path'] = os.path.join(args.outdir, args.s_path)
         params['m_path'] = os.path.join(args.outdir, args.m_path)
     if args.bands is None:
         params['bands'] = get_bands()
     else:
-        freqs = args.bands.replace(',', ' ').split()
-        if len(freqs) < 2:
-            print("[ERROR]: Invalid frequencies!")
-            sys.exit(-1)
-        try:
-            freqs = [float(freq) for freq in freqs]
-        except ValueError:
-            print("[ERROR]: Invalid frequencies")
-        for i in range(0, len(freqs)-1):
-            if freqs[i] >= freqs[i+1]:
-                print("[ERROR]: Invalid sequence of sample rates")
-        params['bands'] = freqs
+        params['bands'] = parse_bands(args.bands)
     if args.decifmax is None:
         params['decifmax'] = get_fmax()
     else:
@@ -251,26 +817,81 @@ def parse_arguments():
         params['commondt'] = get_dt()
     else:
         params['commondt'] = args.commondt
-    if args.azimuth is None:
+    if args.azimuth is None and not args.batch:
         params['azimuth'] = get_azimuth()
     else:
         params['azimuth'] = args.azimuth
     if args.eq_time is None:
         params['eq_time'] = get_earthq()
     else:
-        tokens = args.eq_time.split(':')
-        if len(tokens) < 3:
-            print("[ERROR]: Invalid time format!")
-            sys.exit(-1)
-        try:
-            params['eq_time'] = [float(token) for token in tokens]
-        except ValueError:
-            print("[ERROR]: Invalid time format!")
-            sys.exit(-1)
+        params['eq_time'] = parse_earthq(args.eq_time)
     if args.leading is None:
         params['leading'] = get_leading()
     else:
         params['leading'] = args.leading
+    exit_on_errors(check_params(params))
+    if args.metric_subset is None:
+        params['metrics'] = select_metrics(None)
+    else:
+        metrics = args.metric_subset.upper().replace(',', ' ').split()
+        for metric in metrics:
+            if metric not in METRICS:
+                print("[ERROR]: Invalid metric: %s" % (metric))
+                sys.exit(-1)
+        if not metrics:
+            print("[ERROR]: Invalid sequence of metrics!")
+            sys.exit(-1)
+        params['metrics'] = select_metrics(metrics)
+    params['resume'] = args.resume
+    params['cache_dir'] = args.cache_dir
+    params['cache_size'] = args.cache_size * 1024 * 1024
+    params['store'] = args.store
+    if args.prefetch < 0:
+        print("[ERROR]: Invalid number of stations to prefetch!")
+        sys.exit(-1)
+    params['prefetch'] = args.prefetch
+    if args.stack < 1:
+        print("[ERROR]: Invalid number of stations to stack!")
+        sys.exit(-1)
+    params['stack'] = args.stack
+    if args.threads < 1:
+        print("[ERROR]: Invalid number of threads!")
+        sys.exit(-1)
+    params['threads'] = args.threads
+    params['progress'] = True
+    params['shard'] = None
+    if args.shard is not None:
+        params['shard'] = parse_shard(args.shard)
+        if params['shard'] is None:
+            print("[ERROR]: Invalid shard, expected i/N with 0 <= i < N!")
+            sys.exit(-1)
+    params['her_cache'] = args.her_cache
+    params['spectra_damping'] = None
+    if args.spectra_damping is not None:
+        damping = parse_bands(args.spectra_damping)
+        if not damping or not all(0 < csi < 1 for csi in damping):
+            print("[ERROR]: Invalid damping ratios!")
+            sys.exit(-1)
+        params['spectra_damping'] = damping
+    if args.ko_bandwidth is not None and args.ko_bandwidth <= 0:
+        print("[ERROR]: Invalid Konno-Ohmachi bandwidth!")
+        sys.exit(-1)
+    params['ko_bandwidth'] = args.ko_bandwidth
+    params['periods'] = None
+    if args.periods is not None:
+        params['periods'] = args.periods.lower()
+        if params['periods'] != 'nga':
+            try:
+                params['periods'] = int(params['periods'])
+            except ValueError:
+                params['periods'] = 0
+            if params['periods'] < 2:
+                print("[ERROR]: Invalid grid of periods!")
+                sys.exit(-1)
+        if not all(len(period) for period in
+                   band_periods(params['bands'], params['periods'])):
+            print("[ERROR]: Grid of periods has no periods in some bands!")
+            sys.exit(-1)
     # Optional
     params['epi_x'] = args.epicenter_x
     params['epi_y'] = args.epicenter_y
@@ -284,33 +905,23 @@ def main_gof():
     """
     # First let's parse all the arguments that we need
     params = parse_arguments()
+    set_her_cache(params['her_cache'])
+    set_period_grid(params['periods'])
+    set_fas_smoothing(params['ko_bandwidth'])
+    set_score_threads(params['threads'])
+    set_progress(params['progress'])
 
     if not "filelist" in params:
         # Two file option!
-        obs_data, stations = read_files(params['obs_file'],
-                                        params['syn_files'])
-        # processing signals
-        obs_data, stations = process(params['obs_file'], obs_data,
-                                     stations, params)
-
-        # Figure out stations 1 & 2
-        if obs_data is None:
-            station1 = stations[0]
-            station2 = stations[1]
-        else:
-            station1 = obs_data
-            station2 = stations[0]
-
-        # Calculate scores matrix
-        parameter, matrix, flag = scores_matrix(station1, station2,
-                                                params['bands'])
+        parameter, matrix, flag = score_files(params['obs_file'],
+                                              params['syn_files'], params)
 
         # Exit if GOF failed
         if not flag:
             print("[ERROR]: Files not processed!")
             sys.exit(-1)
 
-        print_matrix(params['s_path'], matrix)
+        print_matrix(params['s_path'], matrix, params['metrics'])
         # End: Two-Files Option
     else:
         # Start: List of Files Option
@@ -321,99 +932,142 @@ def main_gof():
             if params["epi_x"] is not None and params["epi_y"] is not None:
                 epi_x = params["epi_x"]
                 epi_y = params["epi_y"]
+            elif params['batch']:
+                exit_on_errors(["Missing --epicenter_x and --epicenter_y "
+                                "in batch mode!"])
             else:
                 # Ask user
                 epi_x, epi_y = get_epicenter()
         else:
             epi_x = epi_y = 0.0
 
-        # open output files
-        try:
-            f = open(params['s_path'], 'w')
-            m = open(params['m_path'], 'w')
-            u = open(os.path.join(params['outdir'], "unprocessed.txt"), 'w')
-        except IOError as err:
-            print(err)
-
         # prepares formats for output files
-        labels = set_labels(params['bands'])
-        m_labels = set_mlabels()
+        labels = set_labels(params['bands'], params['metrics'])
+        m_labels = set_mlabels(params['metrics'])
 
         d = '{:>12}'*2 + '{:>12.8}'*(len(labels)-2) + '\n'
-        f.write(d.format(*labels))
+        s_header = d.format(*labels)
 
         d = '{:>12}'*2 + '{:>12.6}'*(len(m_labels)-2) + '\n'
-        m.write(d.format(*m_labels))
-        f.close()
-        m.close()
+        m_header = d.format(*m_labels)
 
-        # create empty list for pairs that fail to be processed
-        unprocessed = []
-
-        # loop of the list of pairs given in the list-file
-        for i in range(0, len(station_list)):
-            # capture full path to files
-            file1 = find_station(params['indir1'], station_list[i])
-            file2 = find_station(params['indir2'], station_list[i])
-
-            if file1 is None or file2 is None:
-                # Add to list of unprocessed stations
-                if file1 is None:
-                    tmpmsg = "%s (no data)" % (station_list[i])
-                    unprocessed.append(tmpmsg)
-                if file2 is None:
-                    tmpmsg = "%s (no synthetic)" % (station_list[i])
-                    unprocessed.append(tmpmsg)
-
-                print("...Ignoring station:   %s" % (station_list[i]))
-                continue
+        # one set of outputs for each simulation directory
+        runs = []
+        for indir2 in params['indir2s']:
+            if len(params['indir2s']) == 1:
+                outdir = params['outdir']
+            else:
+                outdir = os.path.join(params['outdir'],
+                                      os.path.basename(os.path.normpath(indir2)))
+            runs.append(prepare_outputs(params, indir2, outdir,
+                                        s_header, m_header, station_list))
 
-            # Both files are available, attempts to process...
-            print("\n...Processing pair: " + file1 + " - " + file2)
-
-            # computes epicentral distance
-            x = coor_x[i]
-            y = coor_y[i]
-            epdist = math.sqrt((x-epi_x)**2+(y-epi_y)**2)
-            coord = [x, y, epdist]
-
-            # reads signals
-            obs_data, stations = read_files(file1, [file2])
-
-            # processing signals
-            obs_data, stations = process(file1, obs_data,
-                                         stations, params)
-            station1 = obs_data
-            station2 = stations[0]
-
-            if station1 and station2:
-                parameter, matrix, flag = scores_matrix(station1,
-                                                        station2,
-                                                        params['bands'])
-                # Sanity check to avoid division by zero
-                if not flag:
-                    tmpmsg = "%s (div by zero)" % (station_list[i])
-                    unprocessed.append(tmpmsg)
-                    print("...Ignoring station:   %s (div by zero)" %
+        # list all input directories once
+        index1 = index_station_files(params['indir1'])
+        report_ambiguous(station_list,
+                         [(params['indir1'], index1)] +
+                         [(run['indir2'], run['index']) for run in runs])
+
+        # stations of this shard, the same split on every node
+        selected = range(0, len(station_list))
+        if params['shard'] is not None:
+            indexes = [index1] + [run['index'] for run in runs]
+            sizes = [station_size(station_name, indexes)
+                     for station_name in station_list]
+            selected = shard_stations(sizes, *params['shard'])
+            print("...Shard %d/%d: %d of %d stations" %
+                  (params['shard'][0], params['shard'][1],
+                   len(selected), len(station_list)))
+
+        # decide what to do with each station before reading any file
+        jobs = []
+        for i in selected:
+            actions = plan_station(station_list[i], index1, runs)
+            if actions:
+                jobs.append((i, actions))
+
+        # loop of the list of pairs given in the list-file, the files
+        # of the next stations are read while the current one is scored;
+        # the processed pairs wait in pending until a stack of them is
+        # scored together, then their results are written in order
+        pending = []
+        for job, files_read in prefetch(jobs, read_station,
+                                        params['prefetch']):
+            i, actions = job
+            obs_read, syn_read = files_read
+            obs_data = None
+            stamp = None
+            k = 0
+
+            for action, run, files, notes in actions:
+                if action == 'skip':
+                    print("...Skipping station:   %s (already processed)" %
                           (station_list[i]))
+                    pending.append((run, notes, None))
+                    continue
+                if action == 'ignore':
+                    print("...Ignoring station:   %s" % (station_list[i]))
+                    pending.append((run, notes, None))
                     continue
-                # end if: sanity check
+                file1, file2 = files
+                stations = [syn_read[k]]
+                k += 1
 
-                parameter = parameter_to_list(parameter)
+                # Both files are available, attempts to process...
+                print("\n...Processing pair: " + file1 + " - " + file2)
 
-                # print scores
-                print_scores([file1, file2], coord,
-                             params['s_path'], [], matrix)
-                # print values used to calculate scores
-                print_scores([file1, file2], coord, params['m_path'],
-                             parameter, np.array([]))
-            else:
-                pass
-            # end if station1 and station2
+                # computes epicentral distance
+                x = coor_x[i]
+                y = coor_y[i]
+                epdist = math.sqrt((x-epi_x)**2+(y-epi_y)**2)
+                coord = [x, y, epdist]
+
+                # processes recorded signals, once for all simulations
+                if obs_data is None:
+                    obs_data, stamp = process_obs(file1, obs_read, params)
+
+                # processes simulated signals
+                station1, stations = process_synthetics(obs_data, stamp,
+                                                        stations, params)
+                station2 = stations[0]
+
+                if station1 and station2:
+                    if params['spectra_damping']:
+                        write_spectra(run['outdir'], file2,
+                                      station1, station2, params)
+
+                    # unrounded scores go straight into the store
+                    raw = None
+                    if run['store'] is not None:
+                        raw = run['store']['scores'][i]
+
+                    pending.append((run, notes, {'index': i,
+                                                 'files': [file1, file2],
+                                                 'coord': coord,
+                                                 'pair': (station1, station2),
+                                                 'raw': raw}))
+                else:
+                    pending.append((run, notes, None))
+                # end if station1 and station2
+            # end loop of the simulations
+
+            if sum(1 for _, _, task in pending if task) >= params['stack']:
+                score_pending(pending, station_list, params)
+                pending = []
         # end loop of the list of pairs
+        score_pending(pending, station_list, params)
 
-        for pair in unprocessed:
-            u.write("%s\n" % pair)
+        for run in runs:
+            if run['store'] is not None:
+                save_store(run['store_path'], run['store'])
+            try:
+                u = open(os.path.join(run['outdir'], "unprocessed.txt"), 'w')
+            except IOError as err:
+                print(err)
+                continue
+            for pair in run['unprocessed']:
+                u.write("%s\n" % pair)
+            u.close()
 
     #end of if instance switch
 
@@ -421,5 +1075,9 @@ def main_gof():
 
 # ============================ MAIN ==============================
 if __name__ == "__main__":
-    main_gof()
+    try:
+        main_gof()
+    except (IOError, ValueError) as err:
+        print("[ERROR]: %s" % (err))
+        sys.exit(-1)
 # end of main program
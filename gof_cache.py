@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+# =============================================================================
+# The program keeps a disk cache of the scores computed for pairs of
+# stations. Entries are addressed by a hash of the processed signals and
+# the parameters used to process and score them; the cache is bounded in
+# size and the least recently used entries are evicted first.
+# =============================================================================
+"""
+from __future__ import division, print_function
+
+import os
+import hashlib
+import numpy as np
+
+# change it whenever the way scores are computed changes,
+# so old entries are not reused
+CACHE_VERSION = "3"
+
+# parameters used to process the signals and get their scores
+KEY_PARAMETERS = ['bands', 'commondt', 'decifmax', 'azimuth',
+                  'leading', 'eq_time', 'metrics', 'periods',
+                  'ko_bandwidth']
+
+def cache_key(station1, station2, params):
+    """
+    Hash the processed signals of two stations together with
+    the parameters used to get their scores
+    """
+    sha = hashlib.sha1()
+    sha.update(CACHE_VERSION.encode('ascii'))
+
+    for station in [station1, station2]:
+        for signal in station:
+            sha.update(repr((signal.samples, float(signal.dt))).encode('ascii'))
+            for data in [signal.accel, signal.velo, signal.displ]:
+                data = np.ascontiguousarray(data, dtype=float)
+                sha.update(repr(data.shape).encode('ascii'))
+                sha.update(data.tobytes())
+
+    for name in KEY_PARAMETERS:
+        sha.update(("%s=%r;" % (name, params.get(name))).encode('ascii'))
+
+    return sha.hexdigest()
+# end of cache_key
+
+def cache_path(cache_dir, key):
+    """
+    Path of the cache entry for a given key
+    """
+    return os.path.join(cache_dir, "%s.npz" % (key))
+# end of cache_path
+
+def load_scores(cache_dir, key):
+    """
+    Returns parameter, matrix, flag, raw for a cached pair of stations
+    (raw being the scores before rounding), or None if the pair
+    is not in the cache
+    """
+    path = cache_path(cache_dir, key)
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with np.load(path) as entry:
+            parameter = entry['parameter']
+            matrix = entry['matrix']
+            flag = bool(entry['flag'])
+            raw = entry['raw']
+    except (IOError, KeyError, ValueError):
+        # damaged entry, compute it again
+        return None
+
+    # mark entry as recently used
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+    return parameter, matrix, flag, raw
+# end of load_scores
+
+def save_scores(cache_dir, key, parameter, matrix, flag, raw, max_size):
+    """
+    Stores the scores of a pair of stations in the cache, then evicts
+    the least recently used entries until the cache fits in max_size bytes
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+    path = cache_path(cache_dir, key)
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as out_file:
+            np.savez(out_file, parameter=parameter, matrix=matrix,
+                     flag=np.array(flag), raw=raw)
+        os.rename(tmp_path, path)
+    except (IOError, OSError) as err:
+        print(err)
+        return
+
+    evict(cache_dir, max_size)
+# end of save_scores
+
+def evict(cache_dir, max_size):
+    """
+    Removes the least recently used entries until
+    the cache is smaller than max_size bytes
+    """
+    entries = []
+    total = 0
+    for filename in os.listdir(cache_dir):
+        if not filename.endswith('.npz'):
+            continue
+        path = os.path.join(cache_dir, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+# end of evict
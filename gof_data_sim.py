@@ -7,11 +7,11 @@
 # =============================================================================
 """
 from __future__ import division, print_function
-import math
 import numpy as np
-from scipy import interpolate
 from seism import seism_psignal, s_filter
-from stools import seism_cutting, seism_appendzeros
+from stools import new_alignment, plan_cutting, plan_appendzeros, \
+    rotation_matrix
+from ptools import align_station
 
 def get_azimuth():
     """
@@ -36,37 +36,56 @@ def rotate(station, azimuth):
     """
     Station = [psignal_ns, psignal_ew, psignal_up]
     """
-    # checking instance
-    if len(station) != 3:
-        return station
-    for s in station:
-        if not isinstance(s, seism_psignal):
-            return station
-
-    psignal_ns = station[0]
-    psignal_ew = station[1]
-    psignal_up = station[2]
-
-    # Nothing to do
-    if not azimuth:
-        return station
-
-    # rotate data in North and East
-    matrix = np.array([(math.cos(math.radians(azimuth)),
-                        -math.sin(math.radians(azimuth))),
-                       (math.sin(math.radians(azimuth)),
-                        math.cos(math.radians(azimuth)))])
-    [psignal_ns.accel, psignal_ew.accel] = matrix.dot([psignal_ns.accel,
-                                                       psignal_ew.accel])
-    [psignal_ns.velo, psignal_ew.velo] = matrix.dot([psignal_ns.velo,
-                                                     psignal_ew.velo])
-    [psignal_ns.disp, psignal_ew.disp] = matrix.dot([psignal_ns.displ,
-                                                     psignal_ew.displ])
-
-    station = [psignal_ns, psignal_ew, psignal_up]
-    return station
+    return rotate_stations([station], [azimuth])[0]
 # end of rotate
 
+def rotate_stations(stations, azimuths):
+    """
+    Rotates the North and East components of many stations, each one
+    with its own azimuth. The horizontal accel, velo and displ of all
+    stations with the same number of samples are stacked in an array
+    (stations x 2 x 3 x samples) and rotated with a single matrix
+    product; the psignals get views of the result
+    """
+    groups = {}
+    for k, (station, azimuth) in enumerate(zip(stations, azimuths)):
+        # checking instance
+        if len(station) != 3:
+            continue
+        if not all(isinstance(s, seism_psignal) for s in station):
+            continue
+        # Nothing to do
+        if not azimuth:
+            continue
+        sizes = set(data.size for s in station[0:2]
+                    for data in [s.accel, s.velo, s.displ])
+        if len(sizes) != 1:
+            print("[ERROR]: cannot rotate components of different sizes.")
+            continue
+        groups.setdefault(sizes.pop(), []).append(k)
+
+    for samples, members in groups.items():
+        data = np.empty((len(members), 2, 3, samples))
+        for i, k in enumerate(members):
+            for j in range(0, 2):
+                data[i, j, 0] = stations[k][j].accel
+                data[i, j, 1] = stations[k][j].velo
+                data[i, j, 2] = stations[k][j].displ
+        matrices = np.array([rotation_matrix(azimuths[k]) for k in members])
+
+        # rotate data in North and East
+        data = np.matmul(matrices, data.reshape(len(members), 2, 3*samples))
+        data = data.reshape(len(members), 2, 3, samples)
+
+        for i, k in enumerate(members):
+            for j in range(0, 2):
+                stations[k][j].accel = data[i, j, 0]
+                stations[k][j].velo = data[i, j, 1]
+                stations[k][j].displ = data[i, j, 2]
+
+    return stations
+# end of rotate_stations
+
 # ============================================================================
 
 def get_dt():
@@ -95,6 +114,9 @@ def interp(data, samples, old_dt, new_dt):
     """
     Call interpolate on given data
     """
+    # scipy is only loaded when a signal is interpolated
+    from scipy import interpolate
+
     old_t = np.arange(0, samples*old_dt, old_dt)
     if old_t.size == samples+1:
         old_t = old_t[:-1]
@@ -161,23 +183,30 @@ def get_earthq():
     """
     Get the earthquake start time
     """
-    time = raw_input("== Enter the earthquake start time (#:#:#.#): ")
-    time = time.split(':')
-    if len(time) < 3:
+    time = parse_earthq(raw_input("== Enter the earthquake "
+                                  "start time (#:#:#.#): "))
+    if time is None:
         print("[ERROR]: invalid time format.")
         return get_earthq()
-    else:
-        for i in range(0, len(time)):
-            try:
-                time[i] = float(time[i])
-            except ValueError:
-                print("[ERROR]: invalid time format.")
-                return get_earthq()
 
     # time = [hour, min, sec, frac]
     return time
 # end of get_earthq
 
+def parse_earthq(text):
+    """
+    Reads an earthquake start time (#:#:#.#),
+    returns None if the format is not valid
+    """
+    time = text.split(':')
+    if len(time) < 3:
+        return None
+    try:
+        return [float(token) for token in time]
+    except ValueError:
+        return None
+# end of parse_earthq
+
 def get_leading():
     """
     Get the simulation leading time
@@ -206,31 +235,30 @@ def synchronize(station1, station2, stamp, eqtimestamp, leading):
     eq_time = eqtimestamp[0]*3600 + eqtimestamp[1]*60 + eqtimestamp[2]
     sim_start = eq_time - leading
 
+    plans1 = [new_alignment(signal.samples, signal.dt) for signal in station1]
+    plans2 = [new_alignment(signal.samples, signal.dt) for signal in station2]
+
     for i in range(0, 3):
-        signal1 = station1[i]
-        signal2 = station2[i]
-        samples1 = signal1.samples
-        samples2 = signal2.samples
+        plan1 = plans1[i]
+        plan2 = plans2[i]
+        samples1 = plan1['samples']
+        samples2 = plan2['samples']
 
-        dt = signal1.dt # same dt of two signals
+        dt = plan1['dt'] # same dt of two signals
 
         # synchronize the start time
         if start < sim_start:
             # data time < sim time < earthquake time; cutting data array
-            signal1 = seism_cutting('front', (sim_start - start),
-                                    20, signal1, False)
+            plan_cutting('front', (sim_start - start), 20, plan1)
 
         elif start > eq_time:
             # sim time < earthquake time < data time; adding zeros in front
-            signal1 = seism_appendzeros('front', (start - eq_time),
-                                        20, signal1)
-            signal2 = seism_cutting('front', (eq_time - sim_start),
-                                    20, signal2, False)
+            plan_appendzeros('front', (start - eq_time), 20, plan1)
+            plan_cutting('front', (eq_time - sim_start), 20, plan2)
 
         else:
             # sim time < data time < earthquake time; adding zeros
-            signal1 = seism_appendzeros('front', (start - sim_start),
-                                        20, signal1)
+            plan_appendzeros('front', (start - sim_start), 20, plan1)
 
         # synchronize the ending time
         data_time = dt * samples1 # total time of data signal
@@ -239,24 +267,24 @@ def synchronize(station1, station2, stamp, eqtimestamp, leading):
         sim_end = sim_start + sim_time
 
         if sim_end < end:
-            # adding zeros in simulation signal
-            # signal2 = seism_appendzeros('end', (end - sim_end), 20, signal2)
-            signal1 = seism_cutting('end', (end - sim_end), 20, signal1, False)
+            # cutting from data signal
+            plan_cutting('end', (end - sim_end), 20, plan1)
 
         elif end < sim_end:
             # cutting from simulation signal
-            signal2 = seism_cutting('end', (sim_end - end), 20, signal2, False)
+            plan_cutting('end', (sim_end - end), 20, plan2)
         else:
             pass
 
         # scale the data if they have one sample in difference after synchronizing
-        if signal1.samples == signal2.samples+1:
-            seism_appendzeros('end', signal2.dt, 20, signal2)
-        elif signal2.samples == signal1.samples+1:
-            seism_appendzeros('end', signal1.dt, 20, signal1)
-
-        station1[i] = signal1
-        station2[i] = signal2
+        if plan1['samples'] == plan2['samples']+1:
+            plan_appendzeros('end', plan2['dt'], 20, plan2)
+        elif plan2['samples'] == plan1['samples']+1:
+            plan_appendzeros('end', plan1['dt'], 20, plan1)
+
+    # cut, pad and taper each station at once
+    align_station(station1, plans1)
+    align_station(station2, plans2)
 
     return station1, station2
 # end of synchronize
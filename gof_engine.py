@@ -8,22 +8,97 @@
 """
 from __future__ import division, print_function
 
+import os
 import sys
 import copy
 import numpy as np
 from seism import integrate
-from stools import max_osc_response, get_points, get_period, FAS
-from ptools import filter_data
+from stools import get_points, get_period, FAS, rotd, response_spectra, \
+    period_grid, band_period
+from ptools import filter_data, filter_array
 
 np.seterr(divide='ignore', invalid='ignore')
 
+# metrics computed by scores_matrix
+METRICS = ['C1', 'C2', 'C3', 'C4', 'C5', 'C6',
+           'C7', 'C8', 'C9', 'C10', 'C11', 'C12', 'C13']
+
+# metrics computed when none are requested, the RotD50 (C12)
+# and RotD100 (C13) spectra are only computed on request
+DEFAULT_METRICS = ['C1', 'C2', 'C3', 'C4', 'C5', 'C6',
+                   'C7', 'C8', 'C9', 'C10', 'C11']
+
+# master grid of periods of the response spectra (see set_period_grid),
+# None uses 20 log-spaced periods in each band
+master_grid = None
+
+# bandwidth of the Konno-Ohmachi smoothing of the Fourier spectra
+# (see set_fas_smoothing), None uses the 3 points smooth
+fas_bandwidth = None
+
+# number of threads computing the cells (component, band) of the
+# matrix of a pair of stations (see set_score_threads)
+score_threads = 1
+
+# progress of the scores written to stdout (see set_progress)
+show_progress = True
+
+# weights of each metric in the total (T) and average (A) scores
+T_WEIGHTS = {'C1': 0.5, 'C2': 0.5, 'C3': 0.5, 'C4': 0.5, 'C5': 1.0,
+             'C6': 1.0, 'C7': 1.0, 'C8': 1.0, 'C9': 1.0, 'C10': 1.0,
+             'C11': 1.0, 'C12': 1.0, 'C13': 1.0}
+A_WEIGHTS = {'C1': 1.0, 'C2': 1.0, 'C3': 1.0, 'C4': 1.0, 'C5': 1.0,
+             'C6': 1.0, 'C7': 1.0, 'C8': 1.0, 'C9': 1.0, 'C10': 1.0,
+             'C11': 0.0, 'C12': 1.0, 'C13': 1.0}
+
+# parameters used to calculate scores and the metric needing each of them
+PARAMETERS = ['PGD', 'PGV', 'PGA', 'A', 'E', 'DUR']
+P_METRICS = {'PGD': 'C7', 'PGV': 'C6', 'PGA': 'C5',
+             'A': 'C3', 'E': 'C4', 'DUR': 'C11'}
+
+def select_metrics(metrics):
+    """
+    Return the requested metrics in the same order used in METRICS,
+    DEFAULT_METRICS are selected if none are given
+    """
+    if not metrics:
+        return list(DEFAULT_METRICS)
+    return [metric for metric in METRICS if metric in metrics]
+# end of select_metrics
+
+def aggregate_scores(scores, metrics):
+    """
+    Compute the total (T) and average (A) scores
+    over the selected metrics
+    """
+    t_weights = np.array([T_WEIGHTS[metric] for metric in metrics])
+    a_weights = np.array([A_WEIGHTS[metric] for metric in metrics])
+    T = np.sum(t_weights*scores)/np.sum(t_weights)
+    if np.sum(a_weights) == 0:
+        # no metric contributes to the average score
+        A = np.nan
+    else:
+        A = np.sum(a_weights*scores)/np.sum(a_weights)
+    return T, A
+# end of aggregate_scores
+
 def update():
     """
     Showing progress
     """
+    if not show_progress:
+        return
     sys.stdout.write('-')
     sys.stdout.flush()
 
+def set_progress(progress):
+    """
+    Sets whether the progress of the scores is written to stdout
+    """
+    global show_progress
+    show_progress = progress
+# end of set_progress
+
 def S(p1, p2):
     # S(p1, p2) = 10*exp{-[(p1-p2)/min(p1, p2)]^2}
     if min(p1, p2) == 0:
@@ -32,6 +107,22 @@ def S(p1, p2):
     s = 10*np.exp(-((p1-p2)/min(p1, p2))**2)
     return s
 
+def S_array(p1, p2):
+    """
+    S of each pair of elements of two arrays, the same
+    values S gives for the pairs one at a time
+    """
+    p1 = np.asarray(p1, float)
+    p2 = np.asarray(p2, float)
+    low = np.where(p2 < p1, p2, p1)
+    ratio = (p1-p2)/low
+    # squared with pow, as S does, the square of numpy
+    # may differ from it in the last bit
+    square = np.array([r**2 for r in ratio.ravel().tolist()])
+    s = 10*np.exp(-square.reshape(ratio.shape))
+    s[low == 0] = -1
+    return s
+
 def cal_peak(data1, data2):
     """
     calculate the socres for peak acc/vel/dis.
@@ -46,7 +137,7 @@ def cal_peak(data1, data2):
 def I(data, dt):
     # I(t) = max|integral(data^2)dt|
     aa = data**2
-    iaa = integrate(aa, dt)[-1]
+    iaa = integrate(aa, dt)[..., -1]
     return iaa
     # return np.amax(np.cumsum(data*data)*dt)
     # return np.amax(np.cumsum(np.square(data))*dt)
@@ -69,7 +160,7 @@ def N(data, dt):
     """
     aa = data**2
     iaa = integrate(aa, dt)
-    norm_iaa = iaa/iaa[-1]
+    norm_iaa = iaa/iaa[..., -1:]
     # print data.size, norm_iaa.size
     return norm_iaa
     # return np.cumsum(data*data)*dt/I(data, dt)
@@ -88,7 +179,7 @@ def cal_SD(data1, data2, dt):
     update()
     N1 = N(data1, dt)
     N2 = N(data2, dt)
-    SD = 10*(1-np.amax(F(N1, N2)))
+    SD = 10*(1-np.amax(F(N1, N2), axis=-1))
     # print np.amax(F(N1, N2)), SD
     return SD
 
@@ -99,8 +190,10 @@ def cal_Sfs(signal1, signal2, fmin, fmax):
     """
     update()
     points = get_points([signal1.samples, signal2.samples])
-    fs1 = FAS(signal1.velo, signal1.dt, points, fmin, fmax, 3)[-1]
-    fs2 = FAS(signal2.velo, signal2.dt, points, fmin, fmax, 3)[-1]
+    fs1 = FAS(signal1.velo, signal1.dt, points, fmin, fmax, 3,
+              fas_bandwidth)[-1]
+    fs2 = FAS(signal2.velo, signal2.dt, points, fmin, fmax, 3,
+              fas_bandwidth)[-1]
     s = np.array([], float)
 
     for i in range(0, fs1.size):
@@ -140,19 +233,63 @@ def cal_C(a1, a2, dt):
     # cc = abs(cc)
     return cc
 
-def cal_Ssa(signal1, signal2, fmin, fmax):
+def set_period_grid(grid):
+    """
+    Sets the master grid of periods used by scores_matrix: a number of
+    log-spaced periods over all the bands, 'nga' for the NGA periods,
+    or None for 20 log-spaced periods in each band
+    """
+    global master_grid
+    master_grid = grid
+# end of set_period_grid
+
+def set_score_threads(threads):
+    """
+    Sets the number of threads computing the cells of the matrix
+    in scores_matrix, 1 computes them one after the other
+    """
+    global score_threads
+    score_threads = threads
+# end of set_score_threads
+
+def set_fas_smoothing(bandwidth):
+    """
+    Sets the bandwidth of the Konno-Ohmachi smoothing applied to the
+    Fourier spectra compared by cal_Sfs, None for the 3 points smooth
+    """
+    global fas_bandwidth
+    fas_bandwidth = bandwidth
+# end of set_fas_smoothing
+
+def band_periods(bands, grid=None):
+    """
+    Periods of the response spectra of each band (BB, B1...Bn),
+    the periods of each band are taken from one master grid if given
+    """
+    limits = [(bands[0], bands[-1])]
+    limits += [(bands[j], bands[j+1]) for j in range(0, len(bands)-1)]
+    if grid is None:
+        return [get_period(1/fmax, 1/fmin) for fmin, fmax in limits]
+    master = period_grid(1/bands[-1], 1/bands[0], grid)
+    return [band_period(master, fmin, fmax) for fmin, fmax in limits]
+# end of band_periods
+
+def cal_Ssa(signal1, signal2, fmin, fmax, period=None):
     """
     Calculate the score for Response Spectra
     """
     update()
-    period = get_period(1/fmax, 1/fmin)
-    SA1 = []
-    SA2 = []
-    for p in period:
-        SA1.append(max_osc_response(signal1.accel, signal1.dt,
-                                    0.05, p, 0, 0)[-1])
-        SA2.append(max_osc_response(signal2.accel, signal2.dt,
-                                    0.05, p, 0, 0)[-1])
+    if period is None:
+        period = get_period(1/fmax, 1/fmin)
+    if (signal1.dt == signal2.dt and
+            signal1.accel.size == signal2.accel.size):
+        # the oscillators of both signals advance together
+        SA1, SA2 = response_spectra(np.array([signal1.accel,
+                                              signal2.accel]),
+                                    signal1.dt, period)[-1][:, 0]
+    else:
+        SA1 = response_spectra(signal1.accel, signal1.dt, period)[-1][0]
+        SA2 = response_spectra(signal2.accel, signal2.dt, period)[-1][0]
 
     ss = []
     for i in range(0, len(SA1)):
@@ -161,56 +298,53 @@ def cal_Ssa(signal1, signal2, fmin, fmax):
     # print np.mean(ss)
     return np.mean(ss)
 
-def duration(signal):
+def cal_Srotd(station1, station2, fmin, fmax, period=None):
     """
-    Get the total duration of signal
+    Calculate the scores for the RotD50 and RotD100 spectra
+    of the horizontal components (N, E) of two stations
+    """
+    update()
+    if period is None:
+        period = get_period(1/fmax, 1/fmin)
+    rotd50_1, rotd100_1 = rotd(station1[0].accel, station1[1].accel,
+                               station1[0].dt, period)
+    rotd50_2, rotd100_2 = rotd(station2[0].accel, station2[1].accel,
+                               station2[0].dt, period)
+
+    s50 = [S(p1, p2) for p1, p2 in zip(rotd50_1, rotd50_2)]
+    s100 = [S(p1, p2) for p1, p2 in zip(rotd100_1, rotd100_2)]
+    return np.mean(s50), np.mean(s100)
+# end of cal_Srotd
+
+def durations(data, dt):
+    """
+    Get the time between 5% and 95% of the normalized Husid plot
+    of data, or of each row of a 2D array (signals x samples)
     """
-    data = signal.velo
-    dt = signal.dt
-
-    # E = max|integral(v^2)dt|
-    # E = I(data, dt)
-    # E5 = 0.05*E
-    # E95 = 0.95*E
-    # T5 = 0
-    # T95 = 0
-
     E = N(data, dt)
+    before = E[..., :-1]
+    after = E[..., 1:]
+    cross5 = (before < 0.05) & (after >= 0.05)
+    cross95 = (before < 0.95) & (after >= 0.95)
+    index = np.arange(1, E.shape[-1])
+
+    # the search stops at the first crossing of 95%,
+    # T5 is the last crossing of 5% up to there
+    found = np.any(cross95, axis=-1)
+    i95 = np.where(found, np.argmax(cross95, axis=-1) + 1, E.shape[-1])
+    i5 = np.amax(np.where(cross5 & (index <= i95[..., np.newaxis]),
+                          index, 0), axis=-1, initial=0)
+
+    T5 = i5*dt
+    T95 = np.where(found, i95, 0)*dt
+    return T95 - T5
+# end of durations
 
-    # print E[-1],
-
-    T5 = 0
-    T95 = 0
-
-    # energy = np.cumsum(data*data)*dt
-    # for i in range(1, energy.size):
-    #       if energy[i-1] <= E5 <= energy[i]:
-    #               T5 = i
-    #       if energy[i-1] <= E95 <= energy[i]:
-    #               T95 = i
-    #               break
-
-    for i in range(1, E.size):
-        if (E[i-1] < 0.05) and (E[i] >= 0.05):
-            T5 = i*dt
-        if (E[i-1] < 0.95) and (E[i] >= 0.95):
-            T95 = i*dt
-            break
-
-    # print T5, T95,
-    D = T95 - T5
-    # print D,
-
-    # t = np.arange(0, signal.samples*signal.dt, signal.dt)
-    # plt.subplot(2, 1, 1)
-    # plt.plot(t,signal.velo,'b')
-    # plt.subplot(2, 1, 2)
-    # plt.plot(t,E,'b')
-    # plt.plot([T5, T5], [0, 1],'r')
-    # plt.plot([T95, T95], [0, 1],'r')
-    # plt.show()
-
-    return D
+def duration(signal):
+    """
+    Get the total duration of signal
+    """
+    return durations(signal.velo, signal.dt)
 # end duration
 
 def cal_D(signal1, signal2):
@@ -226,126 +360,48 @@ def cal_D(signal1, signal2):
 
 #  ============================= GENERATING ==================================
 
-def scores_matrix(station1, station2, thebands):
+def band_limits(bands, j):
     """
-    Generate the 3D matrix of scores
+    Frequency limits of the j-th band, bands being the
+    sequence of frequencies with the highest one inserted first
     """
-
-    # generating local copy of the bands
-    bands = copy.copy(thebands)
-
-    print("...Generating main matrix...")
-    bands.insert(0, bands[len(bands)-1])
-
-    # # Optional plotting for checking
-    # signal1 = station1[1]
-    # signal2 = station2[1]
-    # t1 = np.arange(0, signal1.samples*signal1.dt, signal1.dt)
-    # t2 = np.arange(0, signal2.samples*signal2.dt, signal2.dt)
-    # plt.plot(t1,signal1.accel,'r',t2,signal2.accel,'b')
-    # plt.show()
-
-    c1 = c2 = c3 = c4 = c5 = c6 = c7 = c8 = c9 = c10 = c11 = 0.0
-
-    matrix = np.empty((4, len(bands)+1, 13))
-    parameter = np.empty((3, 12))
-
-    for i in range(1, len(station1)+1):
-
-        # Note: This does not work because...
-        # a) internal data array is mutable
-        # b) even if the object were copied, the coy would be mutable
-        # signal1 = station1[i-1]
-        # signal2 = station2[i-1]
-
-        for j in range(0, len(bands)-1):
-
-            # This is correct because...
-            # a) makes a copy of the object, thus avoid mutation
-            #    of the data array
-            # b) because since the copy is done every time before filtering,
-            #    then it always new
-            signal1 = copy.copy(station1[i-1])
-            signal2 = copy.copy(station2[i-1])
-
-            if j == 0:
-                # BB-Bn
-                fmin = bands[j+1]
-                fmax = bands[j]
-            else:
-                # Bn-Bn+1
-                fmin = bands[j]
-                fmax = bands[j+1]
-            # print fmin, fmax
-
-            # print "\nThis is the signal supposedly before filtering\n\n"
-            # t = np.arange(0, signal1.samples*signal1.dt, signal1.dt)
-            # plt.plot(t,signal1.accel,'r',t,signal2.accel,'b')
-            # plt.show()
-
-            # filtering data
-            signal1 = filter_data(signal1, fmin, fmax)
-            signal2 = filter_data(signal2, fmin, fmax)
-
-            # print "\nThis is the signal after filtering\n\n"
-            # t = np.arange(0, signal1.samples*signal1.dt, signal1.dt)
-            # plt.plot(t,signal1.accel,'r',t,signal2.accel,'b')
-            # plt.show()
-            # plt.plot(t,signal1.velo,'r',t,signal2.velo,'b')
-            # plt.show()
-            # plt.plot(t,signal1.displ,'r',t,signal2.displ,'b')
-            # plt.show()
-
-
-            dt = signal1.dt
-
-            c1 = cal_SD(signal1.accel, signal2.accel, dt)
-            c2 = cal_SD(signal1.velo, signal2.velo, dt)
-
-            # parameter1, parameter2, score for intensity
-            a1, a2, c3 = cal_SI(signal1.accel, signal2.accel, dt)
-            e1, e2, c4 = cal_SI(signal1.velo, signal2.velo, dt)
-
-
-            # parameter1, parameter2, score for peak data
-            pga1, pga2, c5 = cal_peak(signal1.accel, signal2.accel)
-            pgv1, pgv2, c6 = cal_peak(signal1.velo, signal2.velo)
-            pgd1, pgd2, c7 = cal_peak(signal1.displ, signal2.displ)
-
-            c8 = cal_Ssa(signal1, signal2, fmin, fmax)
-            c9 = cal_Sfs(signal1, signal2, fmin, fmax)
-            c10 = cal_C(signal1.accel, signal2.accel, signal1.dt)
-
-            # duration1, duration2, score
-            d1, d2, c11 = cal_D(signal1, signal2)
-
-            # sanity check to avoid division by zero pairs
-            themin = min(c1, c2, c3, c4, c5, c6, c7, c8, c9, c10, c11)
-            if (themin < 0) or np.isnan(themin):
-                return parameter, matrix, False
-            # end if
-
-            scores = np.array([c1, c2, c3, c4, c5, c6,
-                               c7, c8, c9, c10, c11], float)
-            T = ((c1+c2)/2 + (c3+c4)/2 + c5 + c6 + c7 + c8 + c9 + c10 + c11)/9
-            A = (c1+c2+c3+c4+c5+c6+c7+c8+c9+c10)/10
-            scores = np.insert(scores, 0, T)
-            scores = np.insert(scores, 1, A)
-            scores = np.around(scores, decimals=2)
-
-            matrix[i][j] = scores
-
-            # getting parameters used to calculate peak, AI, EI, and duration
-            # for broad band only
-            if j == 0:
-                parameter[i-1] = np.array([pgd1, pgd2, pgv1, pgv2, pga1, pga2,
-                                           a1, a2, e1, e2, d1, d2], float)
-
+    if j == 0:
+        # BB-Bn
+        return bands[j+1], bands[j]
+    # Bn-Bn+1
+    return bands[j], bands[j+1]
+# end of band_limits
+
+def fill_cell(matrix, raw, i, j, scores, metrics):
+    """
+    Stores the scores of component i and band j in the matrix, after
+    the total (T) and average (A) scores. Returns False, storing
+    nothing, if any score is negative or NaN (division by zero).
+    """
+    themin = np.amin(scores)
+    if (themin < 0) or np.isnan(themin):
+        return False
+
+    T, A = aggregate_scores(scores, metrics)
+    scores = np.insert(scores, 0, T)
+    scores = np.insert(scores, 1, A)
+    if raw is not None:
+        raw[i][j] = scores
+    matrix[i][j] = np.around(scores, decimals=2)
+    return True
+# end of fill_cell
+
+def average_matrix(matrix, raw, bands, metrics):
+    """
+    Fills the average of the bands (SA, CA) of each component
+    and the slide with the average of the three components
+    """
+    for i in range(1, 4):
         SA = np.array([], float)
         CA = np.array([], float)
 
         # calculate the average score of all bands
-        for j in range(0, 13):
+        for j in range(0, len(metrics)+2):
             # SA = avg(B1...Bn)
             avg2 = np.average(matrix[i][:, j][1:len(bands)-1])
             SA = np.append(SA, avg2)
@@ -359,15 +415,406 @@ def scores_matrix(station1, station2, thebands):
         matrix[i][-1] = CA
         matrix[i][-2] = SA
 
+        if raw is not None:
+            raw[i][-1] = np.average(raw[i][:len(bands)-1], axis=0)
+            raw[i][-2] = np.average(raw[i][1:len(bands)-1], axis=0)
 
     # insert the slide contain all AVERAGE values in front
     for i in range(0, len(bands)+1):
-        for j in range(0, 13):
+        for j in range(0, len(metrics)+2):
             average = (matrix[1][i][j] + matrix[2][i][j] + matrix[3][i][j])/3
             matrix[0][i][j] = round(average, 2)
 
+    if raw is not None:
+        raw[0] = (raw[1] + raw[2] + raw[3])/3
+# end of average_matrix
+
+def score_cell(station1, station2, i, fmin, fmax, period, metrics,
+               rotd_score=None):
+    """
+    Scores of the selected metrics for the i-th component (1...3) of
+    two stations in the band fmin-fmax, and the parameters used by
+    them (peaks, intensities and durations of both signals). Given
+    rotd_score, the RotD scores of the band, C12 and C13 are added.
+    """
+    # This is correct because...
+    # a) makes a copy of the object, thus avoid mutation
+    #    of the data array
+    # b) because since the copy is done every time before filtering,
+    #    then it always new
+    signal1 = copy.copy(station1[i-1])
+    signal2 = copy.copy(station2[i-1])
+
+    # print "\nThis is the signal supposedly before filtering\n\n"
+    # t = np.arange(0, signal1.samples*signal1.dt, signal1.dt)
+    # plt.plot(t,signal1.accel,'r',t,signal2.accel,'b')
+    # plt.show()
+
+    # filtering data
+    signal1 = filter_data(signal1, fmin, fmax)
+    signal2 = filter_data(signal2, fmin, fmax)
+
+    # print "\nThis is the signal after filtering\n\n"
+    # t = np.arange(0, signal1.samples*signal1.dt, signal1.dt)
+    # plt.plot(t,signal1.accel,'r',t,signal2.accel,'b')
+    # plt.show()
+    # plt.plot(t,signal1.velo,'r',t,signal2.velo,'b')
+    # plt.show()
+    # plt.plot(t,signal1.displ,'r',t,signal2.displ,'b')
+    # plt.show()
+
+
+    dt = signal1.dt
+
+    # parameters of the metrics that are not selected
+    pgd1 = pgd2 = pgv1 = pgv2 = pga1 = pga2 = np.nan
+    a1 = a2 = e1 = e2 = d1 = d2 = np.nan
+
+    c = {}
+    if 'C1' in metrics:
+        c['C1'] = cal_SD(signal1.accel, signal2.accel, dt)
+    if 'C2' in metrics:
+        c['C2'] = cal_SD(signal1.velo, signal2.velo, dt)
+
+    # parameter1, parameter2, score for intensity
+    if 'C3' in metrics:
+        a1, a2, c['C3'] = cal_SI(signal1.accel, signal2.accel, dt)
+    if 'C4' in metrics:
+        e1, e2, c['C4'] = cal_SI(signal1.velo, signal2.velo, dt)
+
+    # parameter1, parameter2, score for peak data
+    if 'C5' in metrics:
+        pga1, pga2, c['C5'] = cal_peak(signal1.accel, signal2.accel)
+    if 'C6' in metrics:
+        pgv1, pgv2, c['C6'] = cal_peak(signal1.velo, signal2.velo)
+    if 'C7' in metrics:
+        pgd1, pgd2, c['C7'] = cal_peak(signal1.displ, signal2.displ)
+
+    if 'C8' in metrics:
+        c['C8'] = cal_Ssa(signal1, signal2, fmin, fmax, period)
+    if 'C9' in metrics:
+        c['C9'] = cal_Sfs(signal1, signal2, fmin, fmax)
+    if 'C10' in metrics:
+        c['C10'] = cal_C(signal1.accel, signal2.accel, signal1.dt)
+
+    # duration1, duration2, score
+    if 'C11' in metrics:
+        d1, d2, c['C11'] = cal_D(signal1, signal2)
+
+    # RotD50, RotD100
+    if rotd_score is not None and i < 3:
+        c['C12'], c['C13'] = rotd_score
+    elif rotd_score is not None:
+        if 'C8' not in metrics:
+            c['C8'] = cal_Ssa(signal1, signal2, fmin, fmax, period)
+        c['C12'] = c['C13'] = c['C8']
+
+    scores = np.array([c[metric] for metric in metrics], float)
+    parameter = np.array([pgd1, pgd2, pgv1, pgv2, pga1, pga2,
+                          a1, a2, e1, e2, d1, d2], float)
+    return scores, parameter
+# end of score_cell
+
+def band_rotd(station1, station2, fmin, fmax, period):
+    """
+    RotD50 and RotD100 scores of the horizontal components
+    of two stations in the band fmin-fmax
+    """
+    horizontal1 = [filter_data(copy.copy(signal), fmin, fmax)
+                   for signal in station1[0:2]]
+    horizontal2 = [filter_data(copy.copy(signal), fmin, fmax)
+                   for signal in station2[0:2]]
+    return cal_Srotd(horizontal1, horizontal2, fmin, fmax, period)
+# end of band_rotd
+
+def map_cells(function, cells):
+    """
+    Calls function for each cell, in score_threads threads if more
+    than one is set; the results are in the order of cells. With a
+    single thread, each cell is computed when its result is needed
+    """
+    if score_threads < 2 or len(cells) < 2:
+        return (function(*cell) for cell in cells)
+
+    def run(cell):
+        # the error state of numpy is kept for each thread
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return function(*cell)
+
+    # the pool is only loaded when it is used
+    from multiprocessing.pool import ThreadPool
+
+    pool = ThreadPool(min(score_threads, len(cells)))
+    try:
+        return pool.map(run, cells)
+    finally:
+        pool.close()
+        pool.join()
+# end of map_cells
+
+def scores_matrix(station1, station2, thebands, metrics=None, raw=None):
+    """
+    Generate the 3D matrix of scores, only the selected
+    metrics are computed (all of them by default).
+    If given, raw (an array with the shape of the matrix)
+    is filled with the scores before rounding.
+    """
+
+    # generating local copy of the bands
+    bands = copy.copy(thebands)
+    metrics = select_metrics(metrics)
+
+    if show_progress:
+        print("...Generating main matrix...")
+    bands.insert(0, bands[len(bands)-1])
+
+    # # Optional plotting for checking
+    # signal1 = station1[1]
+    # signal2 = station2[1]
+    # t1 = np.arange(0, signal1.samples*signal1.dt, signal1.dt)
+    # t2 = np.arange(0, signal2.samples*signal2.dt, signal2.dt)
+    # plt.plot(t1,signal1.accel,'r',t2,signal2.accel,'b')
+    # plt.show()
+
+    matrix = np.empty((4, len(bands)+1, len(metrics)+2))
+    parameter = np.empty((3, 12))
+
+    # periods of the response spectra, for all components
+    periods = band_periods(thebands, master_grid)
+
+    # RotD scores combine N and E, they are computed once for each band
+    # and used in both rows; the vertical has a single orientation,
+    # so its RotD50 and RotD100 are its response spectrum
+    limits = [band_limits(bands, j) for j in range(0, len(bands)-1)]
+    rotd_scores = [None]*len(limits)
+    if 'C12' in metrics or 'C13' in metrics:
+        rotd_scores = list(map_cells(band_rotd,
+                                     [(station1, station2, fmin, fmax,
+                                       periods[j])
+                                      for j, (fmin, fmax)
+                                      in enumerate(limits)]))
+
+    # the cells of each component and band are independent,
+    # they may be computed in parallel (see set_score_threads)
+    cells = [(i, j) for i in range(1, len(station1)+1)
+             for j in range(0, len(limits))]
+    results = map_cells(score_cell,
+                        [(station1, station2, i, limits[j][0], limits[j][1],
+                          periods[j], metrics, rotd_scores[j])
+                         for i, j in cells])
+
+    for (i, j), (scores, cell_parameter) in zip(cells, results):
+        # sanity check to avoid division by zero pairs
+        if not fill_cell(matrix, raw, i, j, scores, metrics):
+            return parameter, matrix, False
+
+        # getting parameters used to calculate peak, AI, EI, and duration
+        # for broad band only
+        if j == 0:
+            parameter[i-1] = cell_parameter
+
+    average_matrix(matrix, raw, bands, metrics)
+
     return parameter, matrix, True
 
+def stack_key(station1, station2):
+    """
+    Key of the pairs of stations that can be scored together: the
+    dt and number of samples shared by all their signals, None if
+    they are not the same
+    """
+    if len(station1) != 3 or len(station2) != 3:
+        return None
+    keys = set((signal.dt, signal.accel.size, signal.velo.size,
+                signal.displ.size) for signal in station1 + station2)
+    if len(keys) != 1:
+        return None
+    key = keys.pop()
+    if not key[1] == key[2] == key[3]:
+        return None
+    return key[0:2]
+# end of stack_key
+
+def scores_matrices(pairs, thebands, metrics=None, raws=None):
+    """
+    Generate the 3D matrices of scores of many pairs of stations,
+    [(station1, station2), ...], the same ones scores_matrix gives
+    for each pair. The pairs whose signals share the dt and number
+    of samples are scored together (see stacked_scores).
+    Returns a list of (parameter, matrix, flag) in the order of pairs.
+    """
+    if raws is None:
+        raws = [None]*len(pairs)
+
+    groups = {}
+    for k, (station1, station2) in enumerate(pairs):
+        key = stack_key(station1, station2)
+        if key is None:
+            # scored alone
+            key = k
+        groups.setdefault(key, []).append(k)
+
+    results = [None]*len(pairs)
+    for members in groups.values():
+        if len(members) == 1:
+            k = members[0]
+            results[k] = scores_matrix(pairs[k][0], pairs[k][1],
+                                       thebands, metrics, raws[k])
+            continue
+        group = stacked_scores([pairs[k] for k in members], thebands,
+                               metrics, [raws[k] for k in members])
+        for k, result in zip(members, group):
+            results[k] = result
+    return results
+# end of scores_matrices
+
+def stacked_scores(pairs, thebands, metrics=None, raws=None):
+    """
+    Scores many pairs of stations with the same dt and number of
+    samples at once. For each component and band the signals of
+    all the pairs are stacked in arrays (2 x pairs, samples), the
+    first stations then the second ones, and filtered together; the
+    peaks, intensities, Husid durations, Fourier and response spectra
+    of all the rows are computed with array operations. Only the
+    cross correlation (C10) and RotD spectra (C12, C13) are still
+    computed one pair at a time.
+    """
+    bands = copy.copy(thebands)
+    metrics = select_metrics(metrics)
+    count = len(pairs)
+    if raws is None:
+        raws = [None]*count
+
+    if show_progress:
+        print("...Generating main matrices of %d stations..." % (count))
+    bands.insert(0, bands[len(bands)-1])
+
+    matrices = [np.empty((4, len(bands)+1, len(metrics)+2))
+                for _ in range(0, count)]
+    parameters = [np.empty((3, 12)) for _ in range(0, count)]
+    flags = [True]*count
+
+    periods = band_periods(thebands, master_grid)
+    dt = pairs[0][0][0].dt
+    samples = pairs[0][0][0].accel.size
+    points = get_points([samples, samples])
+    first = slice(0, count)
+    second = slice(count, 2*count)
+    rotd_metrics = 'C12' in metrics or 'C13' in metrics
+    nan = np.empty(count)
+    nan.fill(np.nan)
+
+    # rows of the first stations, then of the second ones
+    stations = [pair[0] for pair in pairs] + [pair[1] for pair in pairs]
+
+    for j in range(0, len(bands)-1):
+        fmin, fmax = band_limits(bands, j)
+
+        # filtering the data of each component
+        filtered = []
+        for i in range(0, 3):
+            filtered.append([filter_array(np.array([getattr(station[i], name)
+                                                    for station in stations]),
+                                          dt, fmin, fmax)
+                             for name in ['accel', 'velo', 'displ']])
+
+        # RotD scores combine N and E, they are used in both rows
+        if rotd_metrics:
+            rotd50 = np.empty((2*count, len(periods[j])))
+            rotd100 = np.empty((2*count, len(periods[j])))
+            for k in range(0, 2*count):
+                rotd50[k], rotd100[k] = rotd(filtered[0][0][k],
+                                             filtered[1][0][k],
+                                             dt, periods[j])
+            update()
+            rotd_scores = [np.mean(S_array(rotd50[first], rotd50[second]),
+                                   axis=-1),
+                           np.mean(S_array(rotd100[first], rotd100[second]),
+                                   axis=-1)]
+
+        for i in range(1, 4):
+            accel, velo, displ = filtered[i-1]
+
+            # parameters of the metrics that are not selected
+            pgd = pgv = pga = a = e = d = np.r_[nan, nan]
+
+            c = {}
+            if 'C1' in metrics:
+                c['C1'] = cal_SD(accel[first], accel[second], dt)
+            if 'C2' in metrics:
+                c['C2'] = cal_SD(velo[first], velo[second], dt)
+
+            # intensity and peak of each row
+            if 'C3' in metrics:
+                update()
+                a = I(accel, dt)
+                c['C3'] = S_array(a[first], a[second])
+            if 'C4' in metrics:
+                update()
+                e = I(velo, dt)
+                c['C4'] = S_array(e[first], e[second])
+            if 'C5' in metrics:
+                update()
+                pga = np.amax(np.absolute(accel), axis=-1)
+                c['C5'] = S_array(pga[first], pga[second])
+            if 'C6' in metrics:
+                update()
+                pgv = np.amax(np.absolute(velo), axis=-1)
+                c['C6'] = S_array(pgv[first], pgv[second])
+            if 'C7' in metrics:
+                update()
+                pgd = np.amax(np.absolute(displ), axis=-1)
+                c['C7'] = S_array(pgd[first], pgd[second])
+
+            if 'C8' in metrics or (rotd_metrics and i == 3):
+                update()
+                sa = response_spectra(accel, dt, periods[j])[-1][:, 0]
+                c['C8'] = np.mean(S_array(sa[first], sa[second]), axis=-1)
+            if 'C9' in metrics:
+                update()
+                fs = FAS(velo, dt, points, fmin, fmax, 3, fas_bandwidth)[-1]
+                c['C9'] = np.mean(S_array(fs[first], fs[second]), axis=-1)
+            if 'C10' in metrics:
+                c['C10'] = [cal_C(accel[k], accel[count+k], dt)
+                            for k in range(0, count)]
+            if 'C11' in metrics:
+                update()
+                d = durations(velo, dt)
+                c['C11'] = S_array(d[first], d[second])
+
+            # RotD50, RotD100; the vertical uses its response spectrum
+            if rotd_metrics and i < 3:
+                c['C12'], c['C13'] = rotd_scores
+            elif rotd_metrics:
+                c['C12'] = c['C13'] = c['C8']
+
+            for k in range(0, count):
+                if not flags[k]:
+                    continue
+                scores = np.array([c[metric][k] for metric in metrics],
+                                  float)
+                # sanity check to avoid division by zero pairs
+                if not fill_cell(matrices[k], raws[k], i, j,
+                                 scores, metrics):
+                    flags[k] = False
+                    continue
+                # parameters of the broad band only
+                if j == 0:
+                    parameters[k][i-1] = np.array([pgd[k], pgd[count+k],
+                                                   pgv[k], pgv[count+k],
+                                                   pga[k], pga[count+k],
+                                                   a[k], a[count+k],
+                                                   e[k], e[count+k],
+                                                   d[k], d[count+k]],
+                                                  float)
+
+    for k in range(0, count):
+        if flags[k]:
+            average_matrix(matrices[k], raws[k], bands, metrics)
+
+    return list(zip(parameters, matrices, flags))
+# end of stacked_scores
+
 def summary(matrix):
     """
     Generate a summary matrix contain average scores
@@ -386,12 +833,16 @@ def summary(matrix):
     return s
 # end of summary
 
-def parameter_to_list(parameter):
+def parameter_to_list(parameter, metrics=None):
     """
-    Convert the parameter matrix to list
+    Convert the parameter matrix to list, keeping only
+    the parameters used by the selected metrics
     """
+    metrics = select_metrics(metrics)
     p = []
     for i in range(0, 12):
+        if P_METRICS[PARAMETERS[i//2]] not in metrics:
+            continue
         para = parameter[:, i]
         # get the maximum of peak values
         if 0 <= i < 6:
@@ -406,10 +857,11 @@ def parameter_to_list(parameter):
 # end of parameter_to_list
 
 # =========================== PRINTING ======================================
-def print_matrix(path, matrix):
+def print_matrix(path, matrix, metrics=None):
     """
     Generate the file containing the score matrix of two files.
     """
+    metrics = select_metrics(metrics)
     # header = "# GOF " + file1 + ' ' + file2
     s = summary(matrix)
     label = ['AVG', 'N', 'E', 'UP']
@@ -422,7 +874,7 @@ def print_matrix(path, matrix):
         f = open(path, 'w')
     except IOError as e:
         print(e)
-        # return
+        return
 
     # printing summary matrix
     descriptor = '{:>12}' + '  {:>12}'*4 + '\n'
@@ -446,8 +898,7 @@ def print_matrix(path, matrix):
     c_label.insert(0, '')
 
     label1 = ['Average', 'North', 'East', 'Up']
-    r_label = ['T', 'A', 'C1', 'C2', 'C3', 'C4', 'C5',
-               'C6', 'C7', 'C8', 'C9', 'C10', 'C11']
+    r_label = ['T', 'A'] + metrics
 
     d1 = '{:>12}' + '  {:>12}'*(num_b+2) + '\n'
     d2 = '{:>12}' + '  {:>12.2f}'*(num_b+2)+'\n'
@@ -464,6 +915,35 @@ def print_matrix(path, matrix):
     f.close()
 # end of print_matrix
 
+def print_spectra(path, station1, station2, period, damping):
+    """
+    Generate the file containing the acceleration response spectra
+    of two stations for every damping, one row for each period.
+    """
+    labels = ['#PERIOD']
+    columns = [period]
+    for k, station in enumerate([station1, station2]):
+        for name, signal in zip(['N', 'E', 'UP'], station):
+            spectra = response_spectra(signal.accel, signal.dt,
+                                       period, damping)[-1]
+            for csi, spectrum in zip(damping, spectra):
+                labels.append("S%d_%s_%g" % (k+1, name, csi))
+                columns.append(spectrum)
+
+    try:
+        f = open(path, 'w')
+    except IOError as e:
+        print(e)
+        return
+
+    d = '{:>14}'*len(labels) + '\n'
+    f.write(d.format(*labels))
+    d = '{:>14.6e}'*len(labels) + '\n'
+    for row in zip(*columns):
+        f.write(d.format(*row))
+    f.close()
+# end of print_spectra
+
 def print_scores(filenames, coord, path, parameter, matrix):
     """
     Generate the file containing all the scores of a list of files.
@@ -473,6 +953,7 @@ def print_scores(filenames, coord, path, parameter, matrix):
         f = open(path, 'a')
     except IOError as e:
         print(e)
+        return
 
     file1 = filenames[0].split('/')[-1]
     file2 = filenames[1].split('/')[-1]
@@ -483,7 +964,7 @@ def print_scores(filenames, coord, path, parameter, matrix):
     # print the score matrix
     if matrix.size != 0:
         for i in range(0, len(matrix)):
-            for j in range(0, 13):
+            for j in range(0, matrix.shape[2]):
                 # reading matrix slide by column
                 col = matrix[i][:, j]
                 scores.append(col[-1]) #CA
@@ -494,7 +975,7 @@ def print_scores(filenames, coord, path, parameter, matrix):
         d = '{:>12} '*2 + '{:>12.2f}'*(len(scores)-2) + '\n'
 
     # print the parameters used to get scores
-    elif parameter:
+    else:
         scores = scores[:5] + parameter
         d = '{:>12} '*2 + '{:>12.4f}'*(len(scores)-2) + '\n'
 
@@ -502,16 +983,19 @@ def print_scores(filenames, coord, path, parameter, matrix):
     # if parameter:
     #       scores = scores[:5] + parameter + scores[5:]
 
+    # write the whole row at once and make sure it reaches
+    # the disk, so an interrupted run never leaves a partial row
     f.write(d.format(*scores))
+    f.flush()
+    os.fsync(f.fileno())
     f.close()
 # end of print_scores
 
-def set_labels(bands):
+def set_labels(bands, metrics=None):
     # generate labels for scores file
     o = ['A', 'N', 'E', 'U']
     b = ['CA', 'SA']
-    s = ['T', 'A', 'C1', 'C2', 'C3', 'C4', 'C5',
-         'C6', 'C7', 'C8', 'C9', 'C10', 'C11']
+    s = ['T', 'A'] + select_metrics(metrics)
     b_label = "BB"
 
     for i in range(1, len(bands)):
@@ -527,14 +1011,17 @@ def set_labels(bands):
     return labels
 # end of set_labels
 
-def set_mlabels():
+def set_mlabels(metrics=None):
     # set labels for the parameters used to calculate scores
+    metrics = select_metrics(metrics)
     o = ['_', '_NS_', '_EW_', '_UD_']
-    p = ['PGD', 'PGV', 'PGA', 'A', 'E', 'DUR']
+    p = PARAMETERS
     d = ['D', 'S']
     m_labels = ['#SIGNAL1', 'SIGNAL2', 'X_COOR', 'Y_COOR', 'EPI_DIS']
 
     for i in range(0, len(p)):
+        if P_METRICS[p[i]] not in metrics:
+            continue
         for j in range(0, len(d)):
             for k in range(0, len(o)):
                 if i >= 3 and k == 0:
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+"""
+# ==============================================================================
+# The program merges the outputs of gof.py runs over the shards of a list
+# of files (see --shard) into the files a single run would have written:
+# scores, parameters, unprocessed stations, checkpoint and score store,
+# with the stations in the order of the list of files.
+# ==============================================================================
+"""
+from __future__ import division, print_function
+import os
+import sys
+import argparse
+
+from file_utilities import read_filelist
+from gof import read_checkpoint, read_checkpoint_params
+from gof_store import create_store, merge_store, save_store, load_store
+
+def read_rows(path):
+    """
+    Reads a scores or parameters file, returns its header
+    and a dictionary with the row of each pair of files
+    """
+    rows = {}
+    try:
+        with open(path, 'r') as in_file:
+            lines = in_file.readlines()
+    except IOError as err:
+        print(err)
+        sys.exit(-1)
+
+    if not lines:
+        return None, rows
+    for line in lines[1:]:
+        tokens = line.split()
+        # skip rows that were not completely written
+        if not line.endswith('\n') or len(tokens) < 2:
+            continue
+        rows[(tokens[0], tokens[1])] = line
+    return lines[0], rows
+# end of read_rows
+
+def read_unprocessed(path):
+    """
+    Reads the list of unprocessed stations of a shard
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as in_file:
+        return [line.rstrip('\n') for line in in_file if line.strip()]
+# end of read_unprocessed
+
+def find_runs(shard_dirs, s_name):
+    """
+    Returns the directories with the outputs of each run relative to
+    the shard directories: '' for a single run, or the subdirectories
+    of the runs with more than one simulation directory
+    """
+    if all(os.path.exists(os.path.join(dirname, s_name))
+           for dirname in shard_dirs):
+        return ['']
+    runs = set()
+    for dirname in shard_dirs:
+        if not os.path.isdir(dirname):
+            continue
+        for name in os.listdir(dirname):
+            if os.path.exists(os.path.join(dirname, name, s_name)):
+                runs.add(name)
+    return sorted(runs)
+# end of find_runs
+
+def merge_run(station_list, shard_dirs, outdir, params):
+    """
+    Merges the outputs of one run found in shard_dirs into outdir
+    """
+    s_header = m_header = cp_params = None
+    shards = []
+    for dirname in shard_dirs:
+        shard = {}
+        header, shard['s_rows'] = read_rows(os.path.join(dirname,
+                                                         params['scores']))
+        if s_header is None:
+            s_header = header
+        elif header is not None and header != s_header:
+            print("[ERROR]: %s was generated with different bands "
+                  "or metrics!" % (dirname))
+            sys.exit(-1)
+        header, shard['m_rows'] = read_rows(os.path.join(dirname,
+                                                         params['metrics']))
+        if m_header is None:
+            m_header = header
+        checkpoint = os.path.join(dirname, "checkpoint.txt")
+        line = read_checkpoint_params(checkpoint)
+        if line is None or (cp_params is not None and line != cp_params):
+            print("[ERROR]: %s was generated with different processing "
+                  "parameters!" % (dirname))
+            sys.exit(-1)
+        cp_params = line
+        shard['done'] = read_checkpoint(checkpoint)
+        shard['unprocessed'] = read_unprocessed(
+            os.path.join(dirname, "unprocessed.txt"))
+        shards.append(shard)
+
+    if s_header is None or m_header is None:
+        print("[ERROR]: No scores found in %s!" % (", ".join(shard_dirs)))
+        sys.exit(-1)
+
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    s_file = open(os.path.join(outdir, params['scores']), 'w')
+    m_file = open(os.path.join(outdir, params['metrics']), 'w')
+    cp_file = open(os.path.join(outdir, "checkpoint.txt"), 'w')
+    s_file.write(s_header)
+    m_file.write(m_header)
+    cp_file.write(cp_params)
+
+    merged = 0
+    for station in station_list:
+        owners = [shard for shard in shards if station in shard['done']]
+        if not owners:
+            continue
+        if len(owners) > 1:
+            print("[ERROR]: Station %s found in more than one shard!" %
+                  (station))
+            sys.exit(-1)
+        file1, file2, status = owners[0]['done'][station]
+        if status == 'scored':
+            pair = (file1, file2)
+            if (pair not in owners[0]['s_rows'] or
+                    pair not in owners[0]['m_rows']):
+                print("[ERROR]: Missing scores of station %s, "
+                      "it is left out!" % (station))
+                continue
+            s_file.write(owners[0]['s_rows'][pair])
+            m_file.write(owners[0]['m_rows'][pair])
+        cp_file.write("%s %s %s %s\n" % (station, file1, file2, status))
+        merged += 1
+    s_file.close()
+    m_file.close()
+    cp_file.close()
+
+    # notes start with the station name, they keep the order of
+    # the list; the ones of each station keep their order
+    position = dict((station, k) for k, station in enumerate(station_list))
+    notes = [note for shard in shards for note in shard['unprocessed']]
+    notes.sort(key=lambda note: position.get(note.split()[0],
+                                             len(station_list)))
+    with open(os.path.join(outdir, "unprocessed.txt"), 'w') as u_file:
+        for note in notes:
+            u_file.write("%s\n" % (note))
+
+    if params['store'] is not None:
+        stores = [load_store(os.path.join(dirname, params['store']))
+                  for dirname in shard_dirs]
+        stores = [store for store in stores if store is not None]
+        if stores:
+            store = create_store(station_list, list(stores[0]['bands']),
+                                 [str(metric) for metric
+                                  in stores[0]['metrics']])
+            for old_store in stores:
+                merge_store(store, old_store)
+            save_store(os.path.join(outdir, params['store']), store)
+
+    print("...Merged %d stations from %d shards into %s" %
+          (merged, len(shard_dirs), outdir))
+# end of merge_run
+
+def parse_arguments():
+    """
+    Parses the command-line arguments
+    """
+    parser = argparse.ArgumentParser(description="Merges the outputs of "
+                                     "gof.py runs over the shards of a "
+                                     "list of files.")
+    parser.add_argument("--list", dest="filelist", required=True,
+                        help="list of files given to all the shards")
+    parser.add_argument("--output-dir", dest="outdir", required=True,
+                        help="output directory of the merged files")
+    parser.add_argument("--scores", dest="scores", required=True,
+                        help="name of the scores files")
+    parser.add_argument("--metrics", dest="metrics", required=True,
+                        help="name of the files with the parameters")
+    parser.add_argument("--store", dest="store",
+                        help="name of the score store files, if any")
+    parser.add_argument('shard_dirs', nargs='+',
+                        help="output directories of the shards")
+    args = parser.parse_args()
+
+    params = {}
+    params['filelist'] = args.filelist
+    params['outdir'] = args.outdir
+    params['scores'] = os.path.basename(args.scores)
+    params['metrics'] = os.path.basename(args.metrics)
+    params['store'] = None
+    if args.store is not None:
+        params['store'] = os.path.basename(args.store)
+    params['shard_dirs'] = args.shard_dirs
+    for dirname in params['shard_dirs']:
+        if not os.path.isdir(dirname):
+            print("[ERROR]: Shard directory %s does not exist!" % (dirname))
+            sys.exit(-1)
+    return params
+# end of parse_arguments
+
+def merge_main():
+    """
+    Merges the outputs of each run of the shards
+    """
+    params = parse_arguments()
+    station_list, _, _ = read_filelist(params['filelist'])
+
+    runs = find_runs(params['shard_dirs'], params['scores'])
+    if not runs:
+        print("[ERROR]: No scores found in the shard directories!")
+        sys.exit(-1)
+    for run in runs:
+        shard_dirs = [os.path.join(dirname, run)
+                      for dirname in params['shard_dirs']
+                      if os.path.exists(os.path.join(dirname, run,
+                                                     params['scores']))]
+        merge_run(station_list, shard_dirs,
+                  os.path.normpath(os.path.join(params['outdir'], run)),
+                  params)
+# end of merge_main
+
+# ============================ MAIN ==============================
+if __name__ == "__main__":
+    merge_main()
+# end of main program
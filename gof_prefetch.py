@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+# =============================================================================
+# The program reads the input files of upcoming stations in a background
+# thread while the current station is being processed, so the time spent
+# waiting for the file system overlaps with the time spent computing.
+# =============================================================================
+"""
+from __future__ import division, print_function
+
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# marks the end of the jobs in the queue
+_DONE = object()
+
+def prefetch(jobs, reader, depth):
+    """
+    Calls reader for each job in a background thread and yields
+    (job, result) in the order of jobs. At most depth results wait
+    in the queue; with depth 0 every job is read when it is needed.
+    An error in reader (sys.exit included) is raised again when
+    the caller gets to that job.
+    """
+    if depth < 1:
+        for job in jobs:
+            yield job, reader(job)
+        return
+
+    results = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        # wait for room in the queue, unless the caller is gone
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read_all():
+        for job in jobs:
+            try:
+                item = (job, reader(job), None)
+            except BaseException as err:
+                put((job, None, err))
+                return
+            if not put(item):
+                return
+        put(_DONE)
+
+    thread = threading.Thread(target=read_all)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            item = results.get()
+            if item is _DONE:
+                break
+            job, result, err = item
+            if err is not None:
+                raise err
+            yield job, result
+    finally:
+        stop.set()
+# end of prefetch
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""
+# =============================================================================
+# The program keeps the arrays of processed stations (decimated and
+# synchronized psignals) in named blocks of shared memory, so the workers
+# of a process pool attach to them instead of receiving pickled copies.
+# The process that shares a block closes and unlinks it, the workers only
+# close it; shared_stations and attached_stations take care of both.
+# =============================================================================
+"""
+from __future__ import division, print_function
+
+import contextlib
+import numpy as np
+from seism import seism_psignal
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python 2 and Python 3 before 3.8
+    shared_memory = None
+
+# arrays of each psignal kept in the blocks
+SHARED_ARRAYS = ['accel', 'velo', 'displ', 'data']
+
+# offset of every array in a block is a multiple of ALIGNMENT bytes
+ALIGNMENT = 64
+
+def check_available():
+    """
+    Prints an error and returns False if shared memory
+    cannot be used with this version of Python
+    """
+    if shared_memory is None:
+        print("[ERROR]: Shared memory needs Python 3.8 or later.")
+        return False
+    return True
+# end of check_available
+
+def share_stations(stations):
+    """
+    Copies the arrays of the psignals of stations (lists of psignals)
+    into a new block of shared memory. Returns the block and its handle,
+    the small picklable description the workers give to attach_stations.
+    The caller must release the block with unlink=True when the workers
+    are done with it (see shared_stations).
+    """
+    layout = []
+    size = 0
+    for station in stations:
+        signals = []
+        for signal in station:
+            arrays = {}
+            for name in SHARED_ARRAYS:
+                data = np.asarray(getattr(signal, name))
+                arrays[name] = (size, data.shape, data.dtype.str)
+                size += -(-data.nbytes // ALIGNMENT) * ALIGNMENT
+            signals.append({'samples': signal.samples, 'dt': signal.dt,
+                            'type': signal.type, 'arrays': arrays})
+        layout.append(signals)
+
+    # a block cannot be empty
+    block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    try:
+        for station, signals in zip(stations, layout):
+            for signal, items in zip(station, signals):
+                for name, (offset, shape, dtype) in items['arrays'].items():
+                    view = np.ndarray(shape, dtype, block.buf, offset)
+                    view[...] = getattr(signal, name)
+                    del view
+    except BaseException:
+        release_block(block, unlink=True)
+        raise
+
+    return block, {'name': block.name, 'tracker': tracker_pid(),
+                   'stations': layout}
+# end of share_stations
+
+def attach_stations(handle):
+    """
+    Attaches to the block described by handle, returns the block and
+    the stations, whose psignals have read-only views of its arrays.
+    The block must be released, once the stations are not used any
+    more, with release_block (see attached_stations).
+    """
+    block = attach_block(handle['name'], handle['tracker'])
+    stations = []
+    for signals in handle['stations']:
+        station = []
+        for items in signals:
+            signal = seism_psignal()
+            signal.samples = items['samples']
+            signal.dt = items['dt']
+            signal.type = items['type']
+            for name, (offset, shape, dtype) in items['arrays'].items():
+                view = np.ndarray(shape, dtype, block.buf, offset)
+                view.flags.writeable = False
+                setattr(signal, name, view)
+            station.append(signal)
+        stations.append(station)
+    return block, stations
+# end of attach_stations
+
+def attach_block(name, tracker=None):
+    """
+    Attaches to the block of the given name, without registering it
+    to be unlinked when this process ends: only the process that
+    shared it (whose resource tracker is tracker) unlinks it
+    """
+    try:
+        # Python 3.13 or later
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+
+    # before, every attached block is registered with the resource
+    # tracker; a tracker started by this process would unlink the
+    # block (and warn about it) when the process ends. Workers using
+    # the tracker of the process that shared the block (forked, or
+    # spawned, which only know its pipe) leave it registered: the
+    # tracker keeps a single entry that goes away with the unlink
+    from multiprocessing import resource_tracker
+    block = shared_memory.SharedMemory(name=name)
+    pid = tracker_pid()
+    if pid is not None and pid != tracker:
+        resource_tracker.unregister(block._name, "shared_memory")
+    return block
+# end of attach_block
+
+def tracker_pid():
+    """
+    Process id of the resource tracker started by this process (or
+    by the process it was forked from), None if there is not one
+    """
+    try:
+        from multiprocessing import resource_tracker
+    except ImportError:
+        return None
+    return getattr(resource_tracker._resource_tracker, '_pid', None)
+# end of tracker_pid
+
+def release_block(block, unlink=False):
+    """
+    Closes a block, and frees it if unlink (only the process that
+    shared it should). Arrays that are views of the block must be
+    gone before it is closed.
+    """
+    block.close()
+    if unlink:
+        block.unlink()
+# end of release_block
+
+@contextlib.contextmanager
+def shared_stations(stations):
+    """
+    Shares the arrays of stations for the duration of a with block,
+    yields the handle to give to the workers
+    """
+    block, handle = share_stations(stations)
+    try:
+        yield handle
+    finally:
+        release_block(block, unlink=True)
+# end of shared_stations
+
+@contextlib.contextmanager
+def attached_stations(handle):
+    """
+    Attaches to the stations of handle for the duration of a with
+    block, yields the stations; no reference to their arrays
+    may be kept past the block
+    """
+    block, stations = attach_stations(handle)
+    try:
+        yield stations
+    finally:
+        # drop the views so the block can be closed
+        for station in stations:
+            for signal in station:
+                for name in SHARED_ARRAYS:
+                    setattr(signal, name, None)
+        del stations
+        release_block(block)
+# end of attached_stations
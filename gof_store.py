@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+# =============================================================================
+# The program keeps the GOF results of all stations of an event in
+# preallocated arrays, and saves them in a single .npz file so they can
+# be loaded in one read. Scores are kept before rounding.
+# =============================================================================
+"""
+from __future__ import division, print_function
+
+import os
+import numpy as np
+
+def create_store(station_list, bands, metrics):
+    """
+    Preallocates the arrays for the results of a list of stations,
+    scores[k] holds the 4 x (bands+2) x (metrics+2) matrix of station k
+    """
+    num_st = len(station_list)
+    band_labels = ['BB'] + ['B%d' % (i) for i in range(1, len(bands))]
+
+    store = {}
+    store['station'] = list(station_list)
+    store['signal1'] = [''] * num_st
+    store['signal2'] = [''] * num_st
+    store['status'] = [''] * num_st
+    store['coord'] = np.zeros((num_st, 3))
+    store['scores'] = np.empty((num_st, 4, len(bands)+2, len(metrics)+2))
+    store['scores'].fill(np.nan)
+    store['parameter'] = np.empty((num_st, 3, 12))
+    store['parameter'].fill(np.nan)
+    store['bands'] = np.array(bands, float)
+    store['metrics'] = list(metrics)
+    store['score_labels'] = ['T', 'A'] + list(metrics)
+    store['band_labels'] = band_labels + ['SA', 'CA']
+    store['component_labels'] = ['AVG', 'N', 'E', 'UP']
+    return store
+# end of create_store
+
+def store_station(store, k, filenames, coord, status,
+                  raw=None, parameter=None):
+    """
+    Records the results of the k-th station
+    """
+    store['signal1'][k] = filenames[0].split('/')[-1]
+    store['signal2'][k] = filenames[1].split('/')[-1]
+    store['coord'][k] = coord
+    store['status'][k] = status
+    if raw is not None:
+        store['scores'][k] = raw
+    if parameter is not None:
+        store['parameter'][k] = parameter
+# end of store_station
+
+def save_store(path, store):
+    """
+    Writes all arrays of the store to a .npz file
+    """
+    tmp_path = "%s.tmp" % (path)
+    arrays = {}
+    for name, value in store.items():
+        arrays[name] = np.asarray(value)
+    try:
+        with open(tmp_path, 'wb') as out_file:
+            np.savez(out_file, **arrays)
+        os.rename(tmp_path, path)
+    except (IOError, OSError) as err:
+        print(err)
+# end of save_store
+
+def load_store(path):
+    """
+    Reads a .npz file written by save_store, returns a dictionary
+    with its arrays or None if the file cannot be read
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            store = dict((name, data[name]) for name in data.files)
+    except (IOError, ValueError) as err:
+        print(err)
+        return None
+    return store
+# end of load_store
+
+def merge_store(store, old_store):
+    """
+    Copies the results of the stations in old_store (from a previous
+    run with the same bands and metrics) into store, returns the
+    names of the stations copied
+    """
+    copied = set()
+    if old_store is None:
+        return copied
+    if (old_store['scores'].shape[1:] != store['scores'].shape[1:] or
+            list(old_store['metrics']) != store['metrics'] or
+            not np.array_equal(old_store['bands'], store['bands'])):
+        return copied
+
+    rows = {}
+    for k, station in enumerate(old_store['station']):
+        if old_store['status'][k]:
+            rows[str(station)] = k
+
+    for k, station in enumerate(store['station']):
+        if station not in rows:
+            continue
+        old_k = rows[station]
+        store_station(store, k, [str(old_store['signal1'][old_k]),
+                                 str(old_store['signal2'][old_k])],
+                      old_store['coord'][old_k],
+                      str(old_store['status'][old_k]),
+                      old_store['scores'][old_k],
+                      old_store['parameter'][old_k])
+        copied.add(station)
+    return copied
+# end of merge_store
@@ -9,10 +9,13 @@
 from __future__ import print_function
 import os
 import sys
-from sdc import print_her, set_destination
+import multiprocessing
+import sdc
+from sdc import print_her_job, set_destination, set_chunk_size
 
 file_list = []
 path = ''
+workers = 1
 event = ''
 net = ''
 station = ''
@@ -82,14 +85,40 @@ def search():
     destination = ''
     path_list = ''
 
+    global workers
+
+    # optional streaming of long records, given as samples per chunk
+    args = sys.argv[1:]
+    if '--chunk-size' in args:
+        k = args.index('--chunk-size')
+        try:
+            set_chunk_size(int(args[k+1]))
+        except (IndexError, ValueError):
+            print("[ERROR]: invalid chunk size.")
+            sys.exit(-1)
+        del args[k:k+2]
+
+    # optional number of processes generating .her files
+    if '--workers' in args:
+        k = args.index('--workers')
+        try:
+            workers = int(args[k+1])
+        except (IndexError, ValueError):
+            print("[ERROR]: invalid number of workers.")
+            sys.exit(-1)
+        if workers < 1:
+            print("[ERROR]: invalid number of workers.")
+            sys.exit(-1)
+        del args[k:k+2]
+
     # if filename is not given with command we ask for it
-    if len(sys.argv) == 1:
+    if not args:
         while not path_list:
             path_list = raw_input('== Enter the file/directory path: ')
         path_list = path_list.split()
     else:
         # one or more filenames are given; get a list of them
-        path_list = sys.argv[1:]
+        path_list = args
 
     # iterate through paths; search for files with matched options
     for item in path_list:
@@ -133,30 +162,56 @@ def search_pairs(file_list, destination):
     if not file_list:
         return
 
-    file_list = sorted(file_list)
+    # group the files in one pass by network.station.channel-prefix
     orientation = ['N', 'E', 'Z']
-    for f in file_list:
-        file_dict = {}
+    groups = {}
+    keys = []
+    unmatched = []
+    for f in sorted(file_list):
         tmp = f.split('/')[-1]
         tmp = tmp.split('.')
-        if len(tmp) < 5:
-            return
-        info = tmp[3]
-        info = info[0:2]
-        for i in range(0, 3):
-            target = '.' + tmp[1] + '.' + tmp[2] + '.' + info + orientation[i]
-            for ff in file_list:
-                if target in ff:
-                    file_dict[orientation[i]] = os.path.join(path, ff)
-                    if not ff == f:
-                        file_list.remove(ff)
-
-        # process the directory with sdc.py
-        if len(file_dict) == 3:
-            print_her(file_dict)
+        if len(tmp) < 5 or len(tmp[3]) < 3:
+            unmatched.append(f)
+            continue
+        key = '.'.join([tmp[1], tmp[2], tmp[3][0:2]])
+        if key not in groups:
+            groups[key] = {}
+            keys.append(key)
+        channel = tmp[3][2]
+        if channel not in orientation or channel in groups[key]:
+            unmatched.append(f)
+            continue
+        groups[key][channel] = f
+
+    # only complete triples are processed
+    jobs = []
+    for key in keys:
+        group = groups[key]
+        if len(group) == 3:
+            file_dict = {}
+            for channel in orientation:
+                file_dict[channel] = os.path.join(path, group[channel])
+            jobs.append((file_dict, destination, sdc.chunk_size))
         else:
-            print("[ERROR]: No pair found.")
-            print_message(destination, f, 'unprocessed')
+            unmatched.extend([group[channel] for channel in orientation
+                              if channel in group])
+
+    # process the triples with sdc.py
+    if workers > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(workers, len(jobs)))
+        try:
+            pool.map(print_her_job, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for job in jobs:
+            print_her_job(job)
+
+    if unmatched:
+        print("[ERROR]: No pair found for %d files." % (len(unmatched)))
+        print_message(destination, "\n".join(sorted(unmatched)),
+                      'unprocessed')
 # end of search_pairs
 
 def print_message(destination, message, ftype):
@@ -170,5 +225,6 @@ def print_message(destination, message, ftype):
 # end of print_message
 # ----------------------------------------------------------------------------
 
-FILE_LIST, DST_DIR = search()
-search_pairs(FILE_LIST, DST_DIR)
+if __name__ == "__main__":
+    FILE_LIST, DST_DIR = search()
+    search_pairs(FILE_LIST, DST_DIR)
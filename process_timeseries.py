@@ -7,12 +7,20 @@
 from __future__ import division, print_function
 import os
 import sys
+import copy
 import argparse
+from numbers import Real
 
 from file_utilities import print_bbp, read_stamp, read_files
-from ptools import get_bands, filter_data, check_data, synchronize_all_stations
+from ptools import get_bands, parse_bands, filter_data, check_data, \
+    synchronize_all_stations
 from gof_data_sim import get_dt, get_azimuth, get_leading, get_earthq, \
-    get_fmax, rotate, process_signal_dt
+    parse_earthq, get_fmax, rotate_stations, process_signal_dt
+
+# options that must be given in batch mode, as (dest, option)
+BATCH_OPTIONS = [('outdir', '--output-dir'), ('bands', '--bands'),
+                 ('decifmax', '--decimation-freq'), ('commondt', '--dt'),
+                 ('eq_time', '--eq-time'), ('leading', '--leading')]
 
 def get_out():
     """
@@ -30,6 +38,51 @@ def get_out():
 
     return outdir
 
+def missing_options(args, options):
+    """
+    Returns the error messages for the options (dest, option)
+    not given in the command line
+    """
+    return ["Missing %s in batch mode!" % (option)
+            for dest, option in options if getattr(args, dest) is None]
+# end of missing_options
+
+def check_params(params):
+    """
+    Validates the parameters used to process the signals,
+    returns a list with the error messages (empty if all is fine)
+    """
+    errors = []
+    bands = params.get('bands')
+    if bands is None or len(bands) < 2:
+        errors.append("Invalid frequencies!")
+    elif any(bands[i] >= bands[i+1] for i in range(0, len(bands)-1)):
+        errors.append("Invalid sequence of sample rates")
+    for name, label in [('commondt', 'dt'),
+                        ('decifmax', 'decimation frequency')]:
+        if not isinstance(params.get(name), Real) or params[name] <= 0:
+            errors.append("Invalid %s!" % (label))
+    if not isinstance(params.get('leading'), Real):
+        errors.append("Invalid leading time!")
+    eq_time = params.get('eq_time')
+    if eq_time is None or len(eq_time) < 3:
+        errors.append("Invalid time format!")
+    azimuth = params.get('azimuth')
+    if azimuth not in [None, ''] and not isinstance(azimuth, Real):
+        errors.append("Invalid azimuth!")
+    return errors
+# end of check_params
+
+def exit_on_errors(errors):
+    """
+    Prints all the errors found and exits if there is any
+    """
+    for error in errors:
+        print("[ERROR]: %s" % (error))
+    if errors:
+        sys.exit(-1)
+# end of exit_on_errors
+
 def process_station_dt(station, common_dt, fmax):
     """
     Process the station to set a common dt
@@ -48,22 +101,46 @@ def process(obs_file, obs_data, stations, params):
     obs_data: recorded data
     stations: simulation
     """
-    # rotate synthetics
-    stations = [rotate(station, params['azimuth']) for station in stations]
+    stamp = None
+    if obs_data is not None:
+        obs_data, stamp = process_obs(obs_file, obs_data, params)
+
+    return process_synthetics(obs_data, stamp, stations, params)
+# end of process
+
+def process_obs(obs_file, obs_data, params):
+    """
+    Processes the recorded data to have the common dt and reads its
+    time stamp. This does not depend on the simulations, so the results
+    can be reused to compare the recorded data against many of them
+    """
+    obs_data = process_station_dt(obs_data,
+                                  params['commondt'],
+                                  params['decifmax'])
+    stamp = read_stamp(obs_file)
+
+    return obs_data, stamp
+# end of process_obs
+
+def process_synthetics(obs_data, stamp, stations, params):
+    """
+    Processes the simulations and aligns them with the recorded data
+    (optional) already processed by process_obs. The recorded data
+    passed in is not modified, an aligned copy of it is returned.
+    Raises ValueError if the processed signals are not valid.
+    """
+    # rotate synthetics, all at once
+    stations = rotate_stations(stations,
+                               [params['azimuth']] * len(stations))
 
     # process signals to have the same dt
-    if obs_data is not None:
-        obs_data = process_station_dt(obs_data,
-                                      params['commondt'],
-                                      params['decifmax'])
     stations = [process_station_dt(station,
                                    params['commondt'],
                                    params['decifmax']) for station in stations]
 
-    # Read obs_file timestamp if needed
-    stamp = None
+    # work on a copy of recorded data, so it can be reused
     if obs_data is not None:
-        stamp = read_stamp(obs_file)
+        obs_data = [copy.copy(signal) for signal in obs_data]
 
     # synchronize starting and ending time of data arrays
     obs_data, stations = synchronize_all_stations(obs_data,
@@ -80,23 +157,20 @@ def process(obs_file, obs_data, stations, params):
 
     for station in stations:
         if station[0].samples != num_samples:
-            print("[ERROR]: two timseries do not have the same number"
-                  " of samples after processing.")
-            sys.exit(-1)
+            raise ValueError("two timseries do not have the same number"
+                             " of samples after processing.")
 
     # Check the data
     if obs_data is not None:
         if not check_data(obs_data):
-            print("[ERROR]: processed recorded data contains errors!")
-            sys.exit(-1)
+            raise ValueError("processed recorded data contains errors!")
     for station in stations:
         if not check_data(station):
-            print("[ERROR]: processed simulated data contains errors!")
-            sys.exit(-1)
+            raise ValueError("processed simulated data contains errors!")
 
     # All done
     return obs_data, stations
-# end of process
+# end of process_synthetics
 
 def parse_arguments():
     """
@@ -122,6 +196,9 @@ def parse_arguments():
                         help="sequence of sample rates")
     parser.add_argument("--output-dir", dest="outdir",
                         help="output directory for the outputs")
+    parser.add_argument("--batch", action="store_true", dest="batch",
+                        help="never ask for missing parameters, "
+                        "fail if any of them is not given")
     parser.add_argument('input_files', nargs='*')
     args = parser.parse_args()
 
@@ -133,6 +210,14 @@ def parse_arguments():
         print("[ERROR]: Please provide at least two timeseries to process!")
         sys.exit(-1)
 
+    # In batch mode everything comes from the command line
+    if args.batch:
+        errors = missing_options(args, BATCH_OPTIONS)
+        for filename in [obs_file] + files:
+            if filename is not None and not os.path.isfile(filename):
+                errors.append("No such file: %s" % (filename))
+        exit_on_errors(errors)
+
     # Ask user for any missing input parameters
     params = {}
     if args.outdir is None:
@@ -142,18 +227,7 @@ def parse_arguments():
     if args.bands is None:
         params['bands'] = get_bands()
     else:
-        freqs = args.bands.replace(',', ' ').split()
-        if len(freqs) < 2:
-            print("[ERROR]: Invalid frequencies!")
-            sys.exit(-1)
-        try:
-            freqs = [float(freq) for freq in freqs]
-        except ValueError:
-            print("[ERROR]: Invalid frequencies")
-        for i in range(0, len(freqs)-1):
-            if freqs[i] >= freqs[i+1]:
-                print("[ERROR]: Invalid sequence of sample rates")
-        params['bands'] = freqs
+        params['bands'] = parse_bands(args.bands)
     if args.decifmax is None:
         params['decifmax'] = get_fmax()
     else:
@@ -162,26 +236,19 @@ def parse_arguments():
         params['commondt'] = get_dt()
     else:
         params['commondt'] = args.commondt
-    if args.azimuth is None:
+    if args.azimuth is None and not args.batch:
         params['azimuth'] = get_azimuth()
     else:
         params['azimuth'] = args.azimuth
     if args.eq_time is None:
         params['eq_time'] = get_earthq()
     else:
-        tokens = args.eq_time.split(':')
-        if len(tokens) < 3:
-            print("[ERROR]: Invalid time format!")
-            sys.exit(-1)
-        try:
-            params['eq_time'] = [float(token) for token in tokens]
-        except ValueError:
-            print("[ERROR]: Invalid time format!")
-            sys.exit(-1)
+        params['eq_time'] = parse_earthq(args.eq_time)
     if args.leading is None:
         params['leading'] = get_leading()
     else:
         params['leading'] = args.leading
+    exit_on_errors(check_params(params))
 
     return obs_file, files, params
 
@@ -222,5 +289,9 @@ def process_main():
 
 # ============================ MAIN ==============================
 if __name__ == "__main__":
-    process_main()
+    try:
+        process_main()
+    except (IOError, ValueError) as err:
+        print("[ERROR]: %s" % (err))
+        sys.exit(-1)
 # end of main program
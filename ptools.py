@@ -7,13 +7,23 @@
 from __future__ import division, print_function, absolute_import
 import numpy as np
 from seism import s_filter, seism_psignal
-from stools import seism_cutting, seism_appendzeros
+from stools import (new_alignment, plan_cutting, plan_appendzeros,
+                    align_signals)
 
 def synchronize_all_stations(obs_data, stations, stamp, eqtimestamp, leading):
     """
     synchronize the stating time and ending time of data arrays
     obs_data = recorded data (optional); stations = simulation signal(s)
     """
+    # The cuts and zero paddings are planned first for each component,
+    # then applied to each station at once
+    obs_plans = None
+    if obs_data is not None:
+        obs_plans = [new_alignment(signal.samples, signal.dt)
+                     for signal in obs_data]
+    sim_plans = [[new_alignment(signal.samples, signal.dt)
+                  for signal in station] for station in stations]
+
     # If we have a recorded data time stamp
     if stamp is not None and obs_data is not None:
         start = stamp[0]*3600 + stamp[1]*60 + stamp[2]
@@ -24,24 +34,21 @@ def synchronize_all_stations(obs_data, stations, stamp, eqtimestamp, leading):
             # synchronize the start time
             if start < sim_start:
                 # data time < sim time < earthquake time; cutting data array
-                obs_data[i] = seism_cutting('front', (sim_start - start),
-                                            20, obs_data[i], False)
+                plan_cutting('front', (sim_start - start), 20, obs_plans[i])
             elif start > eq_time:
                 # sim time < earthquake time < data time; adding zeros in front
-                obs_data[i] = seism_appendzeros('front', (start - eq_time),
-                                                20, obs_data[i])
-                for station in stations:
-                    station[i] = seism_cutting('front', (eq_time - sim_start),
-                                               20, station[i], False)
+                plan_appendzeros('front', (start - eq_time), 20, obs_plans[i])
+                for plans in sim_plans:
+                    plan_cutting('front', (eq_time - sim_start), 20, plans[i])
             else:
                 # sim time < data time < earthquake time; adding zeros
-                obs_data[i] = seism_appendzeros('front', (start - sim_start),
-                                                20, obs_data[i])
+                plan_appendzeros('front', (start - sim_start), 20,
+                                 obs_plans[i])
 
     # synchronize the ending time
-    if obs_data is not None:
-        obs_dt = obs_data[0].dt
-        obs_samples = obs_data[0].samples
+    if obs_plans is not None:
+        obs_dt = obs_plans[0]['dt']
+        obs_samples = obs_plans[0]['samples']
         obs_time = obs_dt * obs_samples
     else:
         obs_time = None
@@ -50,61 +57,71 @@ def synchronize_all_stations(obs_data, stations, stamp, eqtimestamp, leading):
     target_time = None
     if obs_time is not None:
         target_time = obs_time
-    for station in stations:
-        station_dt = station[0].dt
-        station_samples = station[0].samples
-        station_time = station_dt * station_samples
+    for plans in sim_plans:
+        station_time = plans[0]['dt'] * plans[0]['samples']
         if target_time is None:
             target_time = station_time
             continue
         target_time = min(target_time, station_time)
 
     # Work on obs_data
-    if obs_data is not None:
+    if obs_plans is not None:
         for i in range(0, 3):
             if obs_time > target_time:
-                obs_data[i] = seism_cutting('end', (obs_time - target_time),
-                                            20, obs_data[i], False)
-        obs_samples = obs_data[0].samples
-        obs_time = obs_dt * obs_samples
+                plan_cutting('end', (obs_time - target_time), 20,
+                             obs_plans[i])
+        obs_samples = obs_plans[0]['samples']
 
     # Work on simulated data
-    for station in stations:
+    for plans in sim_plans:
         for i in range(0, 3):
-            sim_dt = station[i].dt
-            sim_samples = station[i].samples
-            sim_time = sim_dt * sim_samples
+            sim_time = plans[i]['dt'] * plans[i]['samples']
             if sim_time > target_time:
-                station[i] = seism_cutting('end', (sim_time - target_time),
-                                           20, station[i], False)
+                plan_cutting('end', (sim_time - target_time), 20, plans[i])
 
     # scale the data if they have one sample in difference after synchronizing
     total_samples = None
-    if obs_data is not None:
+    if obs_plans is not None:
         total_samples = obs_samples
-    for station in stations:
-        sim_samples = station[0].samples
+    for plans in sim_plans:
+        sim_samples = plans[0]['samples']
         if total_samples is None:
             total_samples = sim_samples
             continue
         total_samples = max(sim_samples, total_samples)
 
     # For obs_data
-    if obs_data is not None:
+    if obs_plans is not None:
         for i in range(0, 3):
-            if obs_data[i].samples == total_samples - 1:
-                obs_data[i] = seism_appendzeros('end', obs_data[i].dt,
-                                                20, obs_data[i])
+            if obs_plans[i]['samples'] == total_samples - 1:
+                plan_appendzeros('end', obs_plans[i]['dt'], 20, obs_plans[i])
     # For simulated data
-    for station in stations:
+    for plans in sim_plans:
         for i in range(0, 3):
-            if station[i].samples == total_samples - 1:
-                station[i] = seism_appendzeros('end', station[i].dt,
-                                               20, station[i])
+            if plans[i]['samples'] == total_samples - 1:
+                plan_appendzeros('end', plans[i]['dt'], 20, plans[i])
+
+    # Now cut, pad and taper the data arrays
+    if obs_data is not None:
+        align_station(obs_data, obs_plans)
+    for station, plans in zip(stations, sim_plans):
+        align_station(station, plans)
 
     return obs_data, stations
 # end of synchronize_all_stations
 
+def align_station(station, plans):
+    """
+    Applies the alignment plans of the three components of a station,
+    components with the same plan are aligned together in one array
+    """
+    if plans[0] == plans[1] == plans[2]:
+        align_signals(plans[0], station)
+    else:
+        for signal, plan in zip(station, plans):
+            align_signals(plan, [signal])
+# end of align_station
+
 def filter_data(psignal, fmin, fmax):
     """
     This function is used to filter with a bandpass filter between fmin/fmax
@@ -113,21 +130,24 @@ def filter_data(psignal, fmin, fmax):
         print("[ERROR]: found error filtering psignal.")
         return False
     delta_t = psignal.dt
-    psignal.accel = s_filter(psignal.accel, delta_t, type='bandpass',
-                             family='butter', fmin=fmin, fmax=fmax,
-                             N=4, rp=0.1, rs=100)
-    psignal.velo = s_filter(psignal.velo, delta_t, type='bandpass',
-                            family='butter', fmin=fmin, fmax=fmax,
-                            N=4, rp=0.1, rs=100)
-    psignal.displ = s_filter(psignal.displ, delta_t, type='bandpass',
-                             family='butter', fmin=fmin, fmax=fmax,
-                             N=4, rp=0.1, rs=100)
+    psignal.accel = filter_array(psignal.accel, delta_t, fmin, fmax)
+    psignal.velo = filter_array(psignal.velo, delta_t, fmin, fmax)
+    psignal.displ = filter_array(psignal.displ, delta_t, fmin, fmax)
 
     psignal.data = np.c_[psignal.displ, psignal.velo, psignal.accel]
 
     return psignal
 # end of filter_data
 
+def filter_array(data, dt, fmin, fmax):
+    """
+    Bandpass filter between fmin/fmax of a data array,
+    or of each row of a 2D array (signals x samples)
+    """
+    return s_filter(data, dt, type='bandpass', family='butter',
+                    fmin=fmin, fmax=fmax, N=4, rp=0.1, rs=100)
+# end of filter_array
+
 def get_bands():
     """
     The function is to allow user specify sample rates.
@@ -173,6 +193,17 @@ def get_bands():
     return bands
 # end of get_bands
 
+def parse_bands(text):
+    """
+    Reads a sequence of sample rates separated by commas or spaces,
+    returns None if any of them is not a number
+    """
+    try:
+        return [float(freq) for freq in text.replace(',', ' ').split()]
+    except ValueError:
+        return None
+# end of parse_bands
+
 def check_data(station):
     """
     Checks the data after rotation, process_dt, and synchronization
@@ -9,13 +9,20 @@ from __future__ import print_function
 
 # Import Python modules
 import os
+import shutil
+import tempfile
+import itertools
 import numpy as np
 from seism import s_filter, integrate, seism_psignal, correct_baseline, \
     seism_signal
-from stools import derivative, seism_cutting
+from stools import derivative, seism_cutting, new_alignment, plan_cutting, \
+    taper_block
 
 destination = ''
 
+# samples read at a time when streaming files, 0 loads whole files
+chunk_size = 0
+
 def set_destination(d):
     """
     The function is to get the user input from process.py.
@@ -24,71 +31,97 @@ def set_destination(d):
     destination = d
 # end of set_destination
 
-def load_file(filename):
+def set_chunk_size(samples):
     """
-    The function is to read general 1-column text files. Return a signal object.
+    Sets the number of samples read at a time; with a chunk size
+    print_her streams the files instead of loading them whole
     """
-    if not filename.lower().endswith("ascii"):
-        print("[ERROR]: process Waveform files in ascii format only.")
-        return
+    global chunk_size
+    chunk_size = samples
+# end of set_chunk_size
 
-    header = ''
+def read_header(f):
+    """
+    Reads the lines of an open ASCII waveform file up to its header.
+    Returns a dictionary with network, station, date, time, dt,
+    data type and time stamp, and the data lines found before the header
+    """
     data_type = {'H': 'v', 'L': 'v', 'N': 'a'}
     # v for velocity; a for acceleration, d for displacement
 
-    network = ''
-    station = ''
-    dt = 0.0
-    date = ''
-    dtype = ''
-
-    f = filename.split('/')[-1]
-    tmp = f.split('.')
-    # event = tmp[0]
-
-    try:
-        f = open(filename, 'r')
-    except IOError as e:
-        print(e)
-        return
-
-    data = np.loadtxt(filename, comments='#', unpack=True)
-    samples = data.size
+    info = {'network': '', 'station': '', 'date': '', 'time': '',
+            'dt': 0.0, 'type': ''}
+    lines = []
+    instr_type = ''
 
     for line in f:
         # get header
         if '#' in line:
             tmp = line.split()
-            network = tmp[1]
-            station = tmp[2]
-            info = tmp[3]
+            info['network'] = tmp[1]
+            info['station'] = tmp[2]
+            code = tmp[3]
 
-            # sample_rate = info[0].upper()
-            instr_type = info[1].upper()
-            # orientation = info[2]
+            # sample_rate = code[0].upper()
+            instr_type = code[1].upper()
+            # orientation = code[2]
 
-            date = tmp[4].split(',')[0]
-            time = tmp[4].split(',')[-1]
+            info['date'] = tmp[4].split(',')[0]
+            info['time'] = tmp[4].split(',')[-1]
             try:
-                dt = float(tmp[6])
+                info['dt'] = float(tmp[6])
             except ValueError:
                 pass
 
             break
+        lines.append(line)
 
     if instr_type in data_type:
-        dtype = data_type[instr_type]
+        info['type'] = data_type[instr_type]
 
-    signal = seism_signal(samples, dt, data, dtype)
-    header = ("# " + network + " " + station + " " + "ASCII" + " "
-              + date + " " + str(samples) + " " + str(dt) + "\n")
-    stamp = date.split('/')+time.split(':')
+    stamp = info['date'].split('/')+info['time'].split(':')
     try:
         stamp = [int(s) for s in stamp[:-1]]+[float(stamp[-1])]
     except ValueError:
         print("[ERROR]: error with time stamp.")
+    info['stamp'] = stamp
+
+    return info, lines
+# end of read_header
+
+def make_header(info, samples):
+    """
+    Header line of the .her file
+    """
+    return ("# " + info['network'] + " " + info['station'] + " " +
+            "ASCII" + " " + info['date'] + " " + str(samples) + " " +
+            str(info['dt']) + "\n")
+# end of make_header
+
+def load_file(filename):
+    """
+    The function is to read general 1-column text files. Return a signal object.
+    """
+    if not filename.lower().endswith("ascii"):
+        print("[ERROR]: process Waveform files in ascii format only.")
+        return
 
-    return signal, stamp, header
+    try:
+        f = open(filename, 'r')
+    except IOError as e:
+        print(e)
+        return
+
+    # header and data are read from the same open file
+    info, lines = read_header(f)
+    data = np.loadtxt(itertools.chain(lines, f), comments='#', unpack=True)
+    f.close()
+    samples = data.size
+
+    signal = seism_signal(samples, info['dt'], data, info['type'])
+    header = make_header(info, samples)
+
+    return signal, info['stamp'], header
 # end of load_file
 
 def process(signal):
@@ -197,6 +230,43 @@ def synchronize(stamps, signals):
     return new_stamp, signals
 # end of synchronize
 
+def her_filename(file_dict):
+    """
+    Name of the .her file for the channels in file_dict
+    """
+    # compose filename
+    filename = file_dict['N'].split('/')[-1]
+    filename = filename.replace((filename.split('.')[0]+'.'), '') #remove event ID
+    filename = filename.replace('N.ascii', '.her')
+    return filename
+# end of her_filename
+
+def update_header(header, new_stamp, samples):
+    """
+    Updates the time stamp and samples of the header after synchronizing
+    """
+    tmp = header.split(' ')
+    tmp[-2] = str(samples)
+    tmp[-3] = '/'.join(new_stamp[0:3]) + ',' + ':'.join(new_stamp[3:])
+
+    header = ''
+    for i in range(0, len(tmp)):
+        header += tmp[i] + ' '
+    # header += '\n'
+    return header
+# end of update_header
+
+def print_her_job(job):
+    """
+    Calls print_her for (file_dict, destination, chunk size),
+    so pairs can be processed in a pool of worker processes
+    """
+    file_dict, dst, chunk = job
+    set_destination(dst)
+    set_chunk_size(chunk)
+    return print_her(file_dict)
+# end of print_her_job
+
 def print_her(file_dict):
     """
     The function generates .her files for each station
@@ -209,10 +279,10 @@ def print_her(file_dict):
         print("==[The function is processing files with 3 channels only.]==")
         return False
 
-    # compose filename
-    filename = file_dict['N'].split('/')[-1]
-    filename = filename.replace((filename.split('.')[0]+'.'), '') #remove event ID
-    filename = filename.replace('N.ascii', '.her')
+    if chunk_size:
+        return print_her_stream(file_dict, chunk_size)
+
+    filename = her_filename(file_dict)
 
     try:
         f = open(os.path.join(destination, filename), 'w')
@@ -236,14 +306,7 @@ def print_her(file_dict):
         new_stamp, [signal_ns, signal_ew, signal_up] = synchronize(stamps, signals)
 
         # update header
-        tmp = header.split(' ')
-        tmp[-2] = str(signal_ns.samples)
-        tmp[-3] = '/'.join(new_stamp[0:3]) + ',' + ':'.join(new_stamp[3:])
-
-        header = ''
-        for i in range(0, len(tmp)):
-            header += tmp[i] + ' '
-        # header += '\n'
+        header = update_header(header, new_stamp, signal_ns.samples)
 
     # process signals
     signal_ns = process(signal_ns)
@@ -300,3 +363,348 @@ def print_her(file_dict):
     f.close()
     print("*Generated .her file at: %s" % (os.path.join(destination, filename)))
 #end of print_her
+
+# ============================================================================
+# Streaming mode: the files are read, filtered, integrated and written
+# chunk_size samples at a time, so memory does not grow with the length
+# of the records. Samples are kept in temporary binary files between
+# steps. The zero-phase filters run their forward and backward passes
+# over those files carrying the filter state from one chunk to the next,
+# so the results are the same as when files are loaded whole.
+# ============================================================================
+
+def read_chunks(filename, chunk):
+    """
+    Yields the samples of an ASCII waveform file in arrays
+    of up to chunk samples
+    """
+    block = []
+    with open(filename, 'r') as f:
+        for line in f:
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            block.append(float(line))
+            if len(block) == chunk:
+                yield np.array(block)
+                block = []
+    if block:
+        yield np.array(block)
+# end of read_chunks
+
+def ascii_to_binary(filename, path, chunk):
+    """
+    Copies the samples of an ASCII waveform file to a binary
+    file of floats, returns it as a read-only array in disk
+    """
+    samples = 0
+    with open(path, 'wb') as out:
+        for block in read_chunks(filename, chunk):
+            out.write(block.tobytes())
+            samples += block.size
+    return open_binary(path, samples)
+# end of ascii_to_binary
+
+def open_binary(path, samples):
+    """
+    Maps a binary file of floats written by the streaming mode
+    """
+    if not samples:
+        return np.array([], float)
+    return np.memmap(path, dtype=float, mode='r', shape=(samples,))
+# end of open_binary
+
+def iter_blocks(data, chunk, start=0, stop=None):
+    """
+    Yields copies of data[start:stop] in blocks of chunk samples
+    """
+    if stop is None:
+        stop = data.size
+    for k in range(start, stop, chunk):
+        yield np.array(data[k:min(k+chunk, stop)])
+# end of iter_blocks
+
+def plan_synchronize(stamps, plans):
+    """
+    Same as synchronize on the alignment plans of the channels,
+    returns the new time stamp
+    """
+    end_time = []
+    start_time = []
+    # convert time stamps to time in seconds
+    for time, plan in zip(stamps, plans):
+        try:
+            start = ((time[2])*24+time[3])*3600 + time[4]*60 + time[5]
+        except IndexError:
+            print("[ERROR]: error with data's time stamp.")
+            return stamps
+
+        end = start + plan['samples']*plan['dt']
+
+        start_time.append(start) # update time lists
+        end_time.append(end)
+
+    start_last = max(start_time)
+    end_first = min(end_time)
+    index = start_time.index(start_last)
+    new_stamp = stamps[index]
+
+    # cutting signals
+    for i in range(0, len(plans)):
+        start = start_time[i]
+        end = end_time[i]
+        if start != start_last:
+            t_diff = start_last - start
+            plan_cutting('front', t_diff, 20, plans[i])
+        if end != end_first:
+            t_diff = end - end_first
+            plan_cutting('end', t_diff, 20, plans[i])
+
+    # convert floats to strings
+    new_stamp = [str(s) for s in new_stamp]
+
+    # scale the data if they have one sample in difference after cutting
+    if not plans[0]['samples'] == plans[1]['samples'] == plans[2]['samples']:
+        for i in range(1, len(plans)):
+            if plans[i]['samples'] == plans[i-1]['samples'] - 1:
+                plans[i-1]['cut_front'] += 1
+                plans[i-1]['samples'] -= 1
+            elif plans[i]['samples'] == plans[i-1]['samples'] + 1:
+                plans[i]['cut_front'] += 1
+                plans[i]['samples'] -= 1
+    return new_stamp
+# end of plan_synchronize
+
+def stream_source(data, plan, mean, chunk):
+    """
+    Yields the samples of a channel, baseline corrected and
+    cut and tapered by its alignment plan
+    """
+    position = plan['cut_front']
+    stop = plan['length'] - plan['cut_end']
+    for block in iter_blocks(data, chunk, position, stop):
+        block = block - mean
+        taper_block(plan, block[np.newaxis], position)
+        position += block.size
+        yield block
+# end of stream_source
+
+def stream_integrate(blocks, dt):
+    """
+    Same as integrate for a signal given in blocks
+    """
+    total = 0.0
+    last = None
+    offset = 0.0
+    for block in blocks:
+        if last is None:
+            # initial condition, see integrate
+            offset = block[0]*dt/2.0
+            increments = np.concatenate([[0.0],
+                                         dt*(block[1:]+block[:-1])/2.0])
+            newdata = np.cumsum(increments)
+        else:
+            data = np.concatenate([[last], block])
+            increments = np.concatenate([[total],
+                                         dt*(data[1:]+data[:-1])/2.0])
+            newdata = np.cumsum(increments)[1:]
+        total = newdata[-1]
+        last = block[-1]
+        yield newdata + offset
+# end of stream_integrate
+
+def stream_derivative(blocks, dt):
+    """
+    Same as derivative for a signal given in blocks
+    """
+    last = 0.0
+    for block in blocks:
+        newdata = np.diff(np.concatenate([[last], block]))/dt
+        last = block[-1]
+        yield newdata
+# end of stream_derivative
+
+def stream_filter(blocks, samples, dt, path, chunk):
+    """
+    Same as the high-pass s_filter used by process for a signal given in
+    blocks: filtfilt with odd extensions at both ends. The forward pass
+    is kept in a temporary file, the result is written to path
+    """
+    from scipy.signal import butter, lfilter, lfilter_zi
+
+    b, a = butter(N=5, Wn=0.05/((1.0/dt)/2.0), btype='highpass',
+                  analog=False)
+    edge = 3 * max(len(a), len(b))
+    if samples <= edge:
+        raise ValueError("The length of the input vector x must be greater "
+                         "than padlen, which is %d." % edge)
+    zi = lfilter_zi(b, a)
+
+    # forward pass over the extended signal
+    forward = np.memmap(path + '.fwd', dtype=float, mode='w+',
+                        shape=(samples + 2*edge,))
+    blocks = iter(blocks)
+    block = next(blocks)
+    while block.size < edge + 1:
+        block = np.concatenate([block, next(blocks)])
+    left = 2*block[0:1] - block[edge:0:-1]
+    forward[0:edge], state = lfilter(b, a, left, zi=zi*left[0])
+    position = edge
+    tail = np.array([], float)
+    while block is not None:
+        forward[position:position+block.size], state = lfilter(b, a, block,
+                                                               zi=state)
+        position += block.size
+        tail = np.concatenate([tail, block])[-(edge+1):]
+        block = next(blocks, None)
+    right = 2*tail[-1:] - tail[-2:-(edge+2):-1]
+    forward[position:], state = lfilter(b, a, right, zi=state)
+
+    # backward pass, from the end of the forward pass
+    out = np.memmap(path, dtype=float, mode='w+', shape=(samples,))
+    state = zi*forward[-1]
+    for stop in range(samples + 2*edge, 0, -chunk):
+        start = max(stop - chunk, 0)
+        data, state = lfilter(b, a, forward[start:stop][::-1], zi=state)
+        data = data[::-1]
+        low = max(start, edge)
+        high = min(stop, samples + edge)
+        if low < high:
+            out[(low-edge):(high-edge)] = data[(low-start):(high-start)]
+    out.flush()
+    del forward
+    os.remove(path + '.fwd')
+    return open_binary(path, samples)
+# end of stream_filter
+
+def process_stream(blocks, samples, dt, dtype, tmpdir, chunk):
+    """
+    Same as process for a channel given in blocks. Returns iterators
+    over the blocks of acc, vel and dis
+    """
+    acc = iter([])
+    vel = iter([])
+    dis = iter([])
+
+    def path(name):
+        return os.path.join(tmpdir, name)
+
+    if dtype == 'a':
+        acc = stream_filter(blocks, samples, dt, path('acc'), chunk)
+        vel = stream_integrate(iter_blocks(acc, chunk), dt)
+        vel = stream_filter(vel, samples, dt, path('vel'), chunk)
+        dis = stream_integrate(iter_blocks(vel, chunk), dt)
+        dis = stream_filter(dis, samples, dt, path('dis'), chunk)
+        acc = iter_blocks(acc, chunk)
+        vel = iter_blocks(vel, chunk)
+        dis = iter_blocks(dis, chunk)
+    elif dtype == 'v':
+        vel = stream_filter(blocks, samples, dt, path('vel'), chunk)
+        dis = stream_integrate(iter_blocks(vel, chunk), dt)
+        dis = stream_filter(dis, samples, dt, path('dis'), chunk)
+        acc = stream_derivative(iter_blocks(vel, chunk), dt)
+        vel = iter_blocks(vel, chunk)
+        dis = iter_blocks(dis, chunk)
+    elif dtype == 'd':
+        dis = stream_filter(blocks, samples, dt, path('dis'), chunk)
+        vel = stream_derivative(iter_blocks(dis, chunk), dt)
+        acc = stream_derivative(stream_derivative(iter_blocks(dis, chunk),
+                                                  dt), dt)
+        dis = iter_blocks(dis, chunk)
+    else:
+        pass
+
+    return acc, vel, dis
+# end of process_stream
+
+def print_her_stream(file_dict, chunk):
+    """
+    Same as print_her, reading, processing and writing the
+    channels chunk samples at a time
+    """
+    # if there are more than three channels, save for later
+    if len(file_dict) > 3:
+        print("==[The function is processing files with 3 channels only.]==")
+        return False
+
+    filename = her_filename(file_dict)
+    channels = [file_dict['N'], file_dict['E'], file_dict['Z']]
+    tmpdir = tempfile.mkdtemp(prefix='sdc-')
+    try:
+        # copy the samples to binary files, they are read many times
+        infos = []
+        data = []
+        for i, channel in enumerate(channels):
+            try:
+                f = open(channel, 'r')
+            except IOError as e:
+                print(e)
+                return False
+            info, _ = read_header(f)
+            f.close()
+            data.append(ascii_to_binary(channel,
+                                        os.path.join(tmpdir, 'raw%d' % (i)),
+                                        chunk))
+            info['samples'] = data[-1].size
+            infos.append(info)
+        header = make_header(infos[-1], infos[-1]['samples'])
+
+        # correct baselines before synchronizing times, see print_her
+        means = [np.average(channel[0:int(channel.size*0.1)])
+                 for channel in data]
+
+        # synchronize signals
+        plans = [new_alignment(info['samples'], info['dt'])
+                 for info in infos]
+        if not (infos[0]['samples'] == infos[1]['samples'] ==
+                infos[2]['samples']):
+            new_stamp = plan_synchronize([info['stamp'] for info in infos],
+                                         plans)
+            header = update_header(header, new_stamp, plans[0]['samples'])
+
+        # process signals
+        results = []
+        for i in range(0, 3):
+            chdir = os.path.join(tmpdir, 'ch%d' % (i))
+            os.mkdir(chdir)
+            blocks = stream_source(data[i], plans[i], means[i], chunk)
+            results.append(process_stream(blocks, plans[i]['samples'],
+                                          infos[i]['dt'], infos[i]['type'],
+                                          chdir, chunk))
+        [acc_ns, vel_ns, dis_ns] = results[0]
+        [acc_ew, vel_ew, dis_ew] = results[1]
+        [acc_up, vel_up, dis_up] = results[2]
+
+        try:
+            f = open(os.path.join(destination, filename), 'w')
+        except IOError as e:
+            print(e)
+            return False
+
+        f.write(header)
+
+        descriptor = '{:>12}' + '  {:>12}'*9 + '\n'
+        f.write(descriptor.format("# time", "dis_ns", "dis_ew", "dis_up",
+                                  "vel_ns", "vel_ew", "vel_up",
+                                  "acc_ns", "acc_ew", "acc_up")) # header
+
+        # time incremented by dt, written one chunk at a time
+        dt = plans[0]['dt']
+        time = None
+        descriptor = '{:>12.3f}' + '  {:>12.7f}'*9 + '\n'
+        for blocks in zip(dis_ns, dis_ew, dis_up, vel_ns, vel_ew, vel_up,
+                          acc_ns, acc_ew, acc_up):
+            times = []
+            for _ in range(0, blocks[0].size):
+                if time is None:
+                    time = 0.000
+                else:
+                    time += dt
+                times.append(time)
+            for row in zip(times, *blocks):
+                f.write(descriptor.format(*row))
+        f.close()
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    print("*Generated .her file at: %s" % (os.path.join(destination, filename)))
+# end of print_her_stream
@@ -7,7 +7,6 @@ from __future__ import division, print_function
 __author__ = 'rtaborda'
 
 import numpy as np
-import matplotlib.pyplot as plt
 import math
 from stools import correct_baseline, scale_signal, integrate, s_filter, baseline_function
 
@@ -99,6 +98,9 @@ class seism_signal(object):
     #end __repr__
 
     def plot(self, flag):
+        # matplotlib is only loaded when something is plotted
+        import matplotlib.pyplot as plt
+
         t = np.arange(0, self.samples*self.dt, self.dt)
         plt.plot(t, self.data)
         if flag == 's':
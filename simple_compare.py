@@ -6,6 +6,7 @@
 """
 from __future__ import division, print_function
 import os
+import sys
 import argparse
 from math import radians, cos, sin, asin, sqrt
 
@@ -13,7 +14,7 @@ import matplotlib as mpl
 if mpl.get_backend() != 'agg':
     mpl.use('Agg') # Disables use of Tk/X11
 from file_utilities import read_file
-from compare_signals import simple_plot, set_parameter
+from compare_signals import simple_plot, set_parameter, set_smoothing
 
 def calculate_distance(epicenter, st_loc):
     """
@@ -59,6 +60,9 @@ def parse_arguments():
                         help="station name")
     parser.add_argument("--station-list", dest="station_list",
                         help="station list with latitude and longitude")
+    parser.add_argument("--ko-bandwidth", dest="ko_bandwidth", type=float,
+                        help="bandwidth of the Konno-Ohmachi smoothing of "
+                        "the Fourier spectra (e.g. 40)")
     parser.add_argument('input_files', nargs='*')
     args = parser.parse_args()
 
@@ -86,6 +90,7 @@ def simple_compare_main():
 
     # Set all other parameters
     parameter = set_parameter(params)
+    set_smoothing(args.ko_bandwidth)
 
     # Set plot title
     plot_title = None
@@ -140,5 +145,9 @@ def simple_compare_main():
 
 # ============================ MAIN ==============================
 if __name__ == "__main__":
-    simple_compare_main()
+    try:
+        simple_compare_main()
+    except (IOError, ValueError) as err:
+        print("[ERROR]: %s" % (err))
+        sys.exit(-1)
 # end of main program